@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import time
+import resource
+import importlib
+from contextlib import redirect_stdout
+
+import utility as U
+
+# Per-problem time limit when benchmarking all problems, in seconds
+BENCH_TIMEOUT = 600
+
+
+def bench_problem(pcode):
+
+    record = { "pcode" : pcode }
+    alpha = time.time()
+
+    pmod = importlib.import_module(pcode)
+
+    startload = dict(U.INPUT_LOAD_TIMER)
+
+    gimp = time.time()
+    pmachine = pmod.PMachine()
+    record["construct_secs"] = time.time() - gimp
+
+    # Machines print progress as they go, keep that out of the timing output
+    gimp = time.time()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        pmachine.run2_completion()
+    runsecs = time.time() - gimp
+
+    record["run_secs"] = runsecs
+    record["total_steps"] = pmachine.step_count
+    record["steps_per_sec"] = pmachine.step_count / runsecs if runsecs > 0 else None
+    record["input_load_calls"] = U.INPUT_LOAD_TIMER["calls"] - startload["calls"]
+    record["input_load_secs"] = U.INPUT_LOAD_TIMER["secs"] - startload["secs"]
+
+    # ru_maxrss is the peak for the whole process, reported in KB on Linux
+    record["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    record["wall_secs"] = time.time() - alpha
+    return record
+
+
+def bench_all(timeout=BENCH_TIMEOUT):
+
+    # Each problem runs in its own process, so the peak memory belongs to that problem
+    records = []
+
+    for pcode in U.get_problem_codes():
+        run = U.run_entry_command("bench", pcode, timeout)
+
+        if run["status"] == "timeout":
+            records.append({ "pcode" : pcode, "error" : "timeout after {} secs".format(timeout) })
+            continue
+
+        if run["status"] == "error" or not run["stdout_lines"][-1].startswith("{"):
+            records.append({ "pcode" : pcode, "error" : run["stderr_last"], "wall_secs" : run["wall_secs"] })
+            continue
+
+        records.append(json.loads(run["stdout_lines"][-1]))
+        print("Benchmarked {}, took {:.03f} secs".format(pcode, run["wall_secs"]), file=sys.stderr)
+
+    return records
@@ -1,5 +1,8 @@
 
+import os
 import sys
+import json
+import time
 import importlib
 
 import utility as U
@@ -9,27 +12,170 @@ sys.path.append("../")
 
 if __name__ == "__main__":
         
-    assert len(sys.argv) >= 3, "Usage entry.py <solve|diagram|run2step|test> pXY ..."
-    assert sys.argv[1] in ['solve', 'diagram', 'run2step', 'test']
+    assert len(sys.argv) >= 3, "Usage entry.py <solve [--resume|--no-checkpoint]|solve all|test all|fastsolve|codegen|diagram|run2step [step ...]|test|bench|profile|heatmap|sweep|history|trace|tracediff|check> pXY ..."
+    assert sys.argv[1] in ['solve', 'fastsolve', 'codegen', 'diagram', 'run2step', 'test', 'bench', 'profile', 'heatmap', 'sweep', 'history', 'trace', 'tracediff', 'check']
+
+    if sys.argv[1] == 'bench':
+        import bench
+
+        if sys.argv[2] == 'all':
+            records = bench.bench_all()
+            outstr = json.dumps(records, indent=2)
+            if len(sys.argv) >= 4:
+                with open(sys.argv[3], 'w') as fh:
+                    fh.write(outstr + "\n")
+            print(outstr)
+            quit()
+
+        # Single problem: the JSON record is the last line of the output
+        print(json.dumps(bench.bench_problem(U.check_problem_code(sys.argv[2]))))
+        quit()
+
+    if sys.argv[2] == 'all' and sys.argv[1] in ['solve', 'test']:
+        import runall
+
+        workers = U.get_option(sys.argv, '--workers')
+        timeout = float(U.get_option(sys.argv, '--timeout', runall.RUN_ALL_TIMEOUT))
+        report = runall.run_all(sys.argv[1], workers=None if workers is None else int(workers), timeout=timeout)
+
+        for line in runall.get_report_lines(report):
+            print(line)
+
+        reportpath = U.get_option(sys.argv, '--report')
+        if reportpath is not None:
+            with open(reportpath, 'w') as fh:
+                fh.write(json.dumps(report, indent=2) + "\n")
+        quit()
+
+    if sys.argv[1] == 'sweep':
+        import sweep
+        sweep.run_sweep_command(U.check_problem_code(sys.argv[2]), sys.argv[3:])
+        quit()
+
+    if sys.argv[1] == 'test' and sys.argv[2] in U.TOOL_TEST_MODULES:
+        importlib.import_module(sys.argv[2]).run_tests()
+        quit()
 
     pcode = U.check_problem_code(sys.argv[2])
     pmod = importlib.import_module(pcode)
 
-    pmachine = pmod.PMachine()
+    # A resumed solve loads the machine from its checkpoint instead of building a fresh one
+    pmachine = None
+    ckptpath = U.get_checkpoint_path(pcode) if sys.argv[1] == 'solve' else None
+
+    if sys.argv[1] == 'solve' and '--resume' in sys.argv[3:]:
+        from finite_state import load_checkpoint
+
+        if os.path.exists(ckptpath):
+            pmachine = load_checkpoint(ckptpath)
+            print("Resumed from checkpoint {} at step {}".format(ckptpath, pmachine.step_count))
+        else:
+            print("No checkpoint at {}, starting a fresh run".format(ckptpath))
+
+    if pmachine is None:
+        pmachine = pmod.PMachine()
+
+    if sys.argv[1] == 'check':
+        problems = pmachine.check_wiring()
+        for problem in problems:
+            print(problem)
+        print("Found {} wiring problems in {} states".format(len(problems), len(pmachine.state_list)))
+        sys.exit(1 if problems else 0)
 
     if sys.argv[1] == 'diagram':
         print("Going to make diagram")
         U.create_diagram(pmachine, pcode)
         quit()
     
+    if sys.argv[1] == 'heatmap':
+        print("Going to profile machine and make heat map diagram")
+        profiler = pmachine.enable_profiler()
+        pmachine.run2_completion()
+        U.create_diagram(pmachine, pcode, keepgv=True, profiler=profiler)
+        quit()
+
+    if sys.argv[1] == 'codegen':
+        import machine_codegen
+        outpath = sys.argv[3] if len(sys.argv) >= 4 else "{}_gen.py".format(pcode)
+        machine_codegen.write_machine_module(pmachine, outpath)
+        print("Wrote generated machine module to {}".format(outpath))
+        quit()
+
+    if sys.argv[1] == 'fastsolve':
+        import machine_codegen
+        runfunc = machine_codegen.build_machine_runner(pmachine)
+        runfunc(pmachine)
+        print("Result is : {}".format(pmachine.get_result()))
+
     if sys.argv[1] == 'solve':
+        # Saves are spaced out by wall time and their own cost, so they stay on unless turned off
+        if '--no-checkpoint' not in sys.argv[3:]:
+            pmachine.enable_checkpoints(ckptpath)
+
+        # Machines that declare a progress metric get aborted if they stop making progress
+        if hasattr(pmachine, 'get_progress_metric'):
+            pmachine.enable_watchdog(progressfunc=pmachine.get_progress_metric)
         pmachine.run2_completion()
         print("Result is : {}".format(pmachine.get_result()))
 
     if sys.argv[1] == 'run2step':
+        # Several step counts run to each in turn; going back to an earlier one replays from a snapshot
+        stepcounts = [int(arg) for arg in sys.argv[3:]]
+
+        if len(stepcounts) > 1:
+            pmachine.enable_time_travel()
+
+        for stepcount in stepcounts:
+            print("Running machine to step {}".format(stepcount))
+
+            if stepcount < pmachine.step_count:
+                alpha = time.time()
+                pmachine.run2_step_count(stepcount)
+                print("Went back to step {} in {:.03f} secs, machine is in state {}".format(stepcount, time.time()-alpha, pmachine.get_state()))
+                continue
+
+            summary = pmachine.run_n_steps(stepcount - pmachine.step_count)
+            print("Ran {} steps in {:.03f} secs, machine is in state {}".format(summary.steps, summary.elapsed, summary.final_state))
+
+    if sys.argv[1] == 'history':
         stepcount = int(sys.argv[3])
-        print("Running machine to step {}".format(stepcount))
-        pmachine.run2_step_count(stepcount)
+        numentry = int(sys.argv[4]) if len(sys.argv) >= 5 else 20
+        history = pmachine.enable_history(numentry)
+        pmachine.run_n_steps(stepcount - pmachine.step_count)
+        print("Last {} steps before step {}, machine is in state {}".format(len(history), pmachine.step_count, pmachine.get_state()))
+
+        for line in history.get_report_lines(pmachine):
+            print(line)
+
+    if sys.argv[1] == 'trace':
+        outpath = sys.argv[3] if len(sys.argv) >= 4 else "{}.trace".format(pcode)
+        trace = pmachine.enable_trace()
+        pmachine.run2_completion()
+        trace.write(outpath)
+        print("Result is : {}".format(pmachine.get_result()))
+        print("Wrote trace of {} queries over {} steps to {}".format(trace.num_query, pmachine.step_count, outpath))
+
+    if sys.argv[1] == 'tracediff':
+        from query_trace import load_trace, find_divergence
+        diverge = find_divergence(load_trace(sys.argv[3]), load_trace(sys.argv[4]), pmachine.dispatch_next)
+
+        if diverge is None:
+            print("Traces agree")
+        else:
+            stepcount, stateid, resulta, resultb = diverge
+            print("Traces diverge at step {} in state {}, results are {} and {}".format(stepcount, pmachine.state_list[stateid].__name__, resulta, resultb))
+
+    if sys.argv[1] == 'profile':
+        profiler = pmachine.enable_profiler()
+        pmachine.run2_completion()
+        print("Result is : {}".format(pmachine.get_result()))
+
+        for line in profiler.get_report_lines(maxlines=30):
+            print(line)
+
+        if len(sys.argv) >= 4:
+            profiler.write_collapsed_stacks(sys.argv[3])
+            print("Wrote collapsed stacks to {}".format(sys.argv[3]))
 
     if sys.argv[1] == 'test':
         pmod.run_tests()
\ No newline at end of file
@@ -14,6 +14,33 @@ def status2_code(statstr):
     return int(binform, 2)
 
 
+def build_rule_table(plants_grow):
+    # Byte translation table taking a window code to 1 if a plant grows there, 0 otherwise
+    return bytes([1 if plants_grow.get(code, False) else 0 for code in range(256)])
+
+
+def step_pot_row(potrow, origin, ruletable):
+
+    # One whole generation at once. The row holds one byte per pot, 1 for a plant, starting at pot number origin.
+    # Packed into a big int, five shifted copies of the row add up to every pot's window code in its own byte lane,
+    # the highest never passes 31 so lanes can't carry into each other; one translate then applies the rule table.
+    # The row is padded with 3 empty pots on the left and 2 on the right, the same span the cell by cell version covered.
+    # Returns the new row trimmed of empty pots at both ends, and its origin
+    width = len(potrow) + 5
+    packed = int.from_bytes(potrow, 'little') << 24
+
+    codes = (packed << 16) * 16 + (packed << 8) * 8 + packed * 4 + (packed >> 8) * 2 + (packed >> 16)
+    codes &= (1 << (8 * width)) - 1
+
+    nxtrow = codes.to_bytes(width, 'little').translate(ruletable)
+    trimmed = nxtrow.lstrip(b'\x00')
+    return trimmed.rstrip(b'\x00'), origin - 3 + width - len(trimmed)
+
+
+def get_plant_sum(potrow, origin):
+    return sum(idx for idx, pot in enumerate(potrow, origin) if pot)
+
+
 class PMachine(FiniteStateMachine):
     
     
@@ -21,44 +48,32 @@ class PMachine(FiniteStateMachine):
         
         statemap = """
         {   
-            "HAI" : "F:CG",
-            "HAG" : "T:PPI",
-            "NGC" : "HAI"
+            "HAG" : "T:PPI"
         }
         """
         
         FiniteStateMachine.__init__(self, json.loads(statemap))
         
-        self.curgen = set()
-        self.nxtgen = set()
-
-        self.curidx = -3
+        self.cur_pots = b''
+        self.cur_origin = 0
+        self.nxt_pots = b''
+        self.nxt_origin = 0
 
         self.generation = 0
-        self.max_generation = 1000000
+        self.max_generation = 20
 
         self.is_test = False
 
     def get_result(self):
-        return sum(self.curgen)
-
-    def get_window_status(self, anidx):
-
-        def plantstr(p):
-            return '#' if p in self.curgen else '.'
-
-        return "".join([plantstr(d+anidx) for d in range(-2, +3)])
+        return get_plant_sum(self.cur_pots, self.cur_origin)
 
     def load_initial_state(self, inline):
         assert inline.startswith("initial state:")
         marks = inline[len("initial state:"):].strip()
 
-        for idx, c in enumerate(marks):
-            assert c in ['.', '#']
-            if c == '#':
-                self.curgen.add(idx)
-
-        #print("Cur gen is {}".format(self.curgen))
+        assert marks.replace('#', '').replace('.', '') == ''
+        self.cur_pots = bytes([1 if c == '#' else 0 for c in marks])
+        self.cur_origin = 0
 
 
     def load_plants_grow(self, inputs):
@@ -78,6 +93,8 @@ class PMachine(FiniteStateMachine):
 
         print(self.plants_grow)
 
+        self.rule_table = build_rule_table(self.plants_grow)
+
     def s1_init_machine(self):
 
         inputfile = 'p12test' if self.is_test else 'p12'
@@ -91,48 +108,26 @@ class PMachine(FiniteStateMachine):
 
     def s3_print_plant_info(self):
 
+        assert len(self.cur_pots) > 0, "Generation died!!!"
 
-        assert len(self.curgen) > 0, "Generation died!!!"
-
-        #minidx = min(self.curgen)-3
-        #maxidx = max(self.curgen)+3
-
-
-        minidx = -3 if self.is_test else min(self.curgen)-3
-        maxidx = 37 if self.is_test else max(self.curgen)+3
+        minidx = -3 if self.is_test else self.cur_origin-3
+        maxidx = 37 if self.is_test else self.cur_origin+len(self.cur_pots)+3
 
         print("{0: <2}: ".format(self.generation), end='')
 
         for idx in range(minidx, maxidx):
-            c = '#' if idx in self.curgen else '.'
+            offset = idx - self.cur_origin
+            c = '#' if 0 <= offset < len(self.cur_pots) and self.cur_pots[offset] else '.'
             print(c, end='')
 
         print("")
 
-    def s5_reset_index(self):
-        self.curidx = min(self.curgen)-3
-
-    def s10_have_another_index(self):
-        return self.curidx < max(self.curgen)+3
-
-    def s11_increment_index(self):
-        self.curidx += 1
-
     def s12_next_gen_calc(self):
-        
-        winstat = self.get_window_status(self.curidx)
-        wincode = status2_code(winstat)
-
-        grow = self.plants_grow.get(wincode, None)
-        assert grow != None 
-
-        if grow:
-            self.nxtgen.add(self.curidx)
-
+        self.nxt_pots, self.nxt_origin = step_pot_row(self.cur_pots, self.cur_origin, self.rule_table)
 
     def s15_cycle_generation(self):
-        self.curgen = self.nxtgen
-        self.nxtgen = set()
+        self.cur_pots = self.nxt_pots
+        self.cur_origin = self.nxt_origin
 
         self.generation += 1
 
@@ -152,6 +147,23 @@ def run_tests():
         assert status2_code(k) == v
         print("confirmed K={} --> V={}".format(k, v))
 
+    # The packed step against the cell by cell rule, for rows with plants at both ends
+    plants_grow = {code : (code * 7) % 3 == 1 for code in range(32)}
+    ruletable = build_rule_table(plants_grow)
+
+    for potstr in ['#', '#..#.#', '##.####...#.#', '#....##.#.#######..#']:
+        plantset = set(idx - 4 for idx, c in enumerate(potstr) if c == '#')
+        expect = set()
+        for idx in range(min(plantset)-3, max(plantset)+3):
+            winstat = "".join(['#' if idx+d in plantset else '.' for d in range(-2, +3)])
+            if plants_grow[status2_code(winstat)]:
+                expect.add(idx)
+
+        potrow = bytes([1 if c == '#' else 0 for c in potstr])
+        nxtrow, nxtorigin = step_pot_row(potrow, -4, ruletable)
+        assert set(idx for idx, pot in enumerate(nxtrow, nxtorigin) if pot) == expect
+        assert len(nxtrow) == 0 or (nxtrow[0] == 1 and nxtrow[-1] == 1)
+
     pmod = PMachine()
     pmod.is_test = True
     pmod.run2_completion()
@@ -6,6 +6,8 @@ from collections import deque, Counter
 import utility as U
 from finite_state import *
 
+from p12a import build_rule_table, step_pot_row, get_plant_sum
+
 def status2_code(statstr):
     assert len(statstr) == 5
     assert statstr.replace('#', '').replace('.', '') == ''
@@ -14,14 +16,6 @@ def status2_code(statstr):
     return int(binform, 2)
 
 
-def get_plant_state_rep(plantset):
-
-    def pcode(idx):
-        return '#' if idx in plantset else '.'
-
-    return "".join([pcode(idx) for idx in range(min(plantset), max(plantset)+1)])
-
-
 class PMachine(FiniteStateMachine):
     
     
@@ -29,8 +23,6 @@ class PMachine(FiniteStateMachine):
         
         statemap = """
         {   
-            "HAI" : "F:IFP",
-            "NGC" : "HAI",
             "IFP" : "T:SC",
             "TMG" : "F:PPI,T:FC"
         }
@@ -38,10 +30,10 @@ class PMachine(FiniteStateMachine):
         
         FiniteStateMachine.__init__(self, json.loads(statemap))
         
-        self.curgen = set()
-        self.nxtgen = set()
-
-        self.curidx = -3
+        self.cur_pots = b''
+        self.cur_origin = 0
+        self.nxt_pots = b''
+        self.nxt_origin = 0
 
         self.generation = 0
         self.max_generation = 20
@@ -52,38 +44,29 @@ class PMachine(FiniteStateMachine):
         self.state_log = {}
 
     def get_result(self):
-        assert get_plant_state_rep(self.curgen) == get_plant_state_rep(self.nxtgen)
 
-        migration = min(self.nxtgen) - min(self.curgen)
-        assert migration == max(self.nxtgen) - max(self.curgen)
+        # At a fixed point the row only slides along, every plant moving the same distance each generation
+        assert self.cur_pots == self.nxt_pots
+
+        migration = self.nxt_origin - self.cur_origin
 
         print("Migration factor is {}".format(migration))
 
         goal_generation = 50000000000
         net_migration = (goal_generation - self.generation) * migration
-        num_plants = len(self.curgen)
+        num_plants = self.cur_pots.count(1)
 
         print("#Plants is {}, generation steps is {}, net is {}".format(num_plants, goal_generation-self.generation, net_migration))
-        return num_plants * net_migration + sum(self.curgen)
-
-
-    def get_window_status(self, anidx):
+        return num_plants * net_migration + get_plant_sum(self.cur_pots, self.cur_origin)
 
-        def plantstr(p):
-            return '#' if p in self.curgen else '.'
-
-        return "".join([plantstr(d+anidx) for d in range(-2, +3)])
 
     def load_initial_state(self, inline):
         assert inline.startswith("initial state:")
         marks = inline[len("initial state:"):].strip()
 
-        for idx, c in enumerate(marks):
-            assert c in ['.', '#']
-            if c == '#':
-                self.curgen.add(idx)
-
-        #print("Cur gen is {}".format(self.curgen))
+        assert marks.replace('#', '').replace('.', '') == ''
+        self.cur_pots = bytes([1 if c == '#' else 0 for c in marks])
+        self.cur_origin = 0
 
 
     def load_plants_grow(self, inputs):
@@ -103,6 +86,11 @@ class PMachine(FiniteStateMachine):
 
         print(self.plants_grow)
 
+        self.rule_table = build_rule_table(self.plants_grow)
+
+    def get_progress_metric(self):
+        return self.generation
+
     def s1_init_machine(self):
 
         inputfile = 'p12test' if self.is_test else 'p12'
@@ -118,49 +106,30 @@ class PMachine(FiniteStateMachine):
 
         if False:
 
-            assert len(self.curgen) > 0, "Generation died!!!"
-
-            #minidx = min(self.curgen)-3
-            #maxidx = max(self.curgen)+3
+            assert len(self.cur_pots) > 0, "Generation died!!!"
 
-
-            minidx = -3 if self.is_test else min(self.curgen)-3
-            maxidx = 37 if self.is_test else max(self.curgen)+3
+            minidx = -3 if self.is_test else self.cur_origin-3
+            maxidx = 37 if self.is_test else self.cur_origin+len(self.cur_pots)+3
 
             print("{0: <2}: ".format(self.generation), end='')
 
             for idx in range(minidx, maxidx):
-                c = '#' if idx in self.curgen else '.'
+                offset = idx - self.cur_origin
+                c = '#' if 0 <= offset < len(self.cur_pots) and self.cur_pots[offset] else '.'
                 print(c, end='')
 
             print("")
 
-    def s5_reset_index(self):
-        self.curidx = min(self.curgen)-3
-
-    def s10_have_another_index(self):
-        return self.curidx < max(self.curgen)+3
-
-    def s11_increment_index(self):
-        self.curidx += 1
-
     def s12_next_gen_calc(self):
-        
-        winstat = self.get_window_status(self.curidx)
-        wincode = status2_code(winstat)
-
-        grow = self.plants_grow.get(wincode, None)
-        assert grow != None 
-
-        if grow:
-            self.nxtgen.add(self.curidx)
+        self.nxt_pots, self.nxt_origin = step_pot_row(self.cur_pots, self.cur_origin, self.rule_table)
 
     def s14_is_fixed_point(self):
-        return get_plant_state_rep(self.curgen) == get_plant_state_rep(self.nxtgen)
+        # Packed rows are trimmed at both ends, so equal bytes means the same pattern, possibly shifted
+        return self.cur_pots == self.nxt_pots
 
     def s15_cycle_generation(self):
-        self.curgen = self.nxtgen
-        self.nxtgen = set()
+        self.cur_pots = self.nxt_pots
+        self.cur_origin = self.nxt_origin
 
         self.generation += 1
 
@@ -1,3 +1,4 @@
+import copy
 import json
 import heapq
 from collections import deque
@@ -23,23 +24,6 @@ def adjacents(pt):
         yield newpt, step
 
 
-def find_path(obstacles, targets, startpt):
-
-    def successors(pt):
-        return [npt for npt, _ in adjacents(pt) if npt not in obstacles]
-
-    def isgoal(pt):
-        return any([npt in targets for npt, _ in adjacents(pt)])
-
-    goal, parents = U.state_search(startpt, successors, isgoal, breadth=True)
-
-    if goal == None:
-        return None
-
-    path = U.extract_path(goal, parents)
-
-    return path
-
 class Creature:
 
     def __init__(self, cid, cc, xp, yp, elf_boost=0):
@@ -54,9 +38,16 @@ class Creature:
         self.attack_pow = 3
 
         # Modification for problem B
+        self.apply_elf_boost(elf_boost)
+
+    def apply_elf_boost(self, boost):
         if self.ccode == 'E':
-            self.attack_pow += elf_boost
+            self.attack_pow += boost
+
 
+    def __deepcopy__(self, memo):
+        # Everything a creature holds is a number or a string, so p15b's forks can use a shallow copy
+        return copy.copy(self)
 
     def get_position(self):
         return (self.xpos, self.ypos)
@@ -122,6 +113,15 @@ class PMachine(FiniteStateMachine):
 
         self.elf_boost = 0
 
+        self.elf_deaths = 0
+
+        # Enemy code --> target_field toward the open cells next to those enemies.
+        # Shared by every unit of the other side until some unit moves or dies
+        self.target_fields = {}
+
+        # Walls don't change once the input is read, so p15b's forks share them
+        self.set_fork_shared("walls")
+
     def get_result(self):
         allhealth = sum([c.health for c in self.creatures.values() ])
         return self.full_round * allhealth
@@ -161,6 +161,13 @@ class PMachine(FiniteStateMachine):
         assert ccode == '.', "Bad input character code {}".format(ccode)
 
 
+    def set_elf_boost(self, boost):
+        # Also boosts any elves already on the map, by the difference from the current boost
+        for creat in self.creatures.values():
+            creat.apply_elf_boost(boost - self.elf_boost)
+
+        self.elf_boost = boost
+
     def s1_init_machine(self):
         infile = 'p15'
         infile += '' if self.test_code == None else 'test'+self.test_code
@@ -172,6 +179,14 @@ class PMachine(FiniteStateMachine):
                 ccode = line[xidx]
                 self.process_input_code(xidx, yidx, ccode)
 
+        # Occupancy grid for the distance fields: walls and creatures are blocked
+        width = max([w[0] for w in self.walls]) + 1
+        height = max([w[1] for w in self.walls]) + 1
+        self.blocked = U.Grid(width, height)
+
+        for pt in list(self.walls) + [c.get_position() for c in self.creatures.values()]:
+            self.blocked[pt] = 1
+
         #print("Read input data, have {} walls and {} creatures".format(len(self.walls), len(self.creatures)))
 
     def s4_init_turn_order(self):
@@ -185,23 +200,29 @@ class PMachine(FiniteStateMachine):
     def s14_enemy_in_range(self):
         return self.get_current_target() != None
 
-    def get_obstacle_set(self):
-        return set(list(self.walls) + [c.get_position() for c in self.creatures.values()])
-
-    def get_target_set(self, enemycode):
-        return set([c.get_position() for c in self.creatures.values() if c.ccode == enemycode])
-
     def s16_step_toward_enemy(self):
 
         creat = self.get_current_creature()
-        bestpath = find_path(self.get_obstacle_set(), self.get_target_set(creat.enemy_code()), creat.get_position())
+        grid = self.blocked
 
-        #print("For CID={}, bestpath={}".format(creat.cid, bestpath))
+        found = U.step_from_field(grid, grid.index(creat.get_position()), self.get_target_field(creat.enemy_code()))
 
-        # Okay, well, actually still have to check.
-        if bestpath != None:
-            assert bestpath[0] == creat.get_position()
-            creat.step2_point(bestpath[1])
+        if found != None:
+            grid[creat.get_position()] = 0
+            creat.step2_point(grid.point(found[1]))
+            grid.cells[found[1]] = 1
+            self.target_fields.clear()
+
+    def get_target_field(self, enemycode):
+
+        if enemycode not in self.target_fields:
+            # Open cells next to an enemy, units of the other side head for the nearest one
+            grid = self.blocked
+            enemies = [c for c in self.creatures.values() if c.ccode == enemycode]
+            targets = set([nidx for e in enemies for nidx in grid.neighbor_indices(grid.index(e.get_position())) if not grid.cells[nidx]])
+            self.target_fields[enemycode] = U.target_field(grid, targets)
+
+        return self.target_fields[enemycode]
 
     def s17_have_attack_target(self):
         return self.get_current_target() != None
@@ -258,9 +279,17 @@ class PMachine(FiniteStateMachine):
     def s28_have_dead_creature(self):
         return self.find_dead_creature() != None
 
+    def no_elf_deaths(self):
+        return self.elf_deaths == 0
+
     def s29_resolve_death(self):
         deadid = self.find_dead_creature().cid
-        self.creatures.pop(deadid)
+        deadcreat = self.creatures.pop(deadid)
+        self.blocked[deadcreat.get_position()] = 0
+        self.target_fields.clear()
+
+        if deadcreat.ccode == 'E':
+            self.elf_deaths += 1
 
         # Filter dead creature out of turn order
         self.turn_order = deque([cid for cid in self.turn_order if cid != deadid])
@@ -2,10 +2,17 @@ import json
 from collections import deque
 
 import utility as U
+import sweep
 from finite_state import *
 
 import p15a
 
+
+def find_min_elf_boost(tcode, maxboost, workers=None):
+    # Runs p15a for each boost in parallel, stopping at the first boost with no elf deaths
+    taskfunc = sweep.ProblemParamTask('p15a', 'elf_boost', testcode=tcode, checkname='no_elf_deaths')
+    return sweep.find_first(taskfunc, range(maxboost+1), predicate=lambda rslt: rslt[1], workers=workers)
+
 class PMachine(FiniteStateMachine):
     
     
@@ -41,11 +48,13 @@ class PMachine(FiniteStateMachine):
         self.init_elf_count = self.get_elf_count(calcmachine)
         print("Calculated initial elf count={} for testcode={}".format(self.init_elf_count, self.test_code))
 
+        # Each boost starts from a fork of this machine, so the input is only read once
+        self.base_machine = calcmachine
+
     def s4_build_sub_machine(self):
         
-        self.submachine = p15a.PMachine()
-        self.submachine.test_code = self.test_code
-        self.submachine.elf_boost = self.eboost
+        self.submachine = self.base_machine.fork()
+        self.submachine.set_elf_boost(self.eboost)
 
     def s6_run_sub_machine(self):
         self.submachine.run2_completion()
@@ -125,4 +134,7 @@ def run_tests():
         assert pmach.eboost+3 == rpower[tcode], "Discrepancy in power for tcode={}".format(tcode)
         print("Test successful for TC={}".format(tcode))
 
+        minboost, (result, _) = find_min_elf_boost(tcode, 50)
+        assert minboost == pmach.eboost and result == scores[tcode], "Sweep found boost {} with result {}".format(minboost, result)
+
 
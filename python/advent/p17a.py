@@ -279,6 +279,10 @@ class PMachine(FiniteStateMachine):
     def s36_poll_probe_point(self):
         self.probes.popleft()
 
+    def get_progress_metric(self):
+        # Water only spreads and gains support marks, so this goes up until the steady state
+        return sum(self.newbrd.values())
+
     def s40_reached_steady_state(self):
         return len(self.change_list) == 0
 
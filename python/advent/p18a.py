@@ -1,11 +1,41 @@
 import json
-import copy
-from collections import deque
-from collections import Counter
 
 import utility as U
 from finite_state import *
 
+# Per-cell flag bits for the growth rule, from the neighbor counts and the terrain
+TREES_3 = 1
+TREES_1 = 2
+LUMBER_3 = 4
+LUMBER_1 = 8
+TERRAIN_TREES = 16
+TERRAIN_LUMBER = 32
+
+
+def count_flag_byte(cnt):
+    # Neighbor counts come in one byte, trees in the low nibble and lumberyards in the high one
+    trees, lumber = cnt & 15, cnt >> 4
+    flags = (TREES_3 if trees >= 3 else 0) | (TREES_1 if trees >= 1 else 0)
+    return flags | (LUMBER_3 if lumber >= 3 else 0) | (LUMBER_1 if lumber >= 1 else 0)
+
+def growth_rule(code):
+    if code & TERRAIN_TREES:
+        return '#' if code & LUMBER_3 else '|'
+
+    if code & TERRAIN_LUMBER:
+        return '#' if code & LUMBER_1 and code & TREES_1 else '.'
+
+    return '|' if code & TREES_3 else '.'
+
+
+NEIGHBOR_WEIGHT_TABLE = bytes([{ '|' : 1, '#' : 16 }.get(chr(val), 0) for val in range(256)])
+
+COUNT_FLAG_TABLE = bytes([count_flag_byte(cnt) for cnt in range(256)])
+
+TERRAIN_CODE_TABLE = bytes([{ '|' : TERRAIN_TREES, '#' : TERRAIN_LUMBER }.get(chr(val), 0) for val in range(256)])
+
+GROWTH_RULE_TABLE = bytes([ord(growth_rule(code)) for code in range(256)])
+
 
 class PMachine(FiniteStateMachine):
     
@@ -21,8 +51,11 @@ class PMachine(FiniteStateMachine):
         
         FiniteStateMachine.__init__(self, json.loads(statemap))
 
-        # list of lists
-        self.geography = []
+        # Grid of terrain characters, and the back buffer for the next minute
+        self.geography = None
+        self.new_geo = None
+
+        self.lane_counter = None
 
         self.minute = 0
 
@@ -32,20 +65,16 @@ class PMachine(FiniteStateMachine):
 
     def get_result(self):
 
-        rcounter = Counter([c for row in self.geography for c in row])
-        return rcounter['|'] * rcounter['#']
+        return self.geography.count(ord('|')) * self.geography.count(ord('#'))
 
     def s1_init_machine(self):
 
         infile = 'p18test' if self.is_test else 'p18'
         lines = U.read_input_deque(infile)
 
-        for line in lines:
-            georow = []
-            for c in line:
-                georow.append(c)
-
-            self.geography.append(georow)
+        self.geography = U.Grid.from_lines([line for line in lines if line])
+        self.new_geo = self.geography.copy()
+        self.lane_counter = U.LaneCounter(self.geography.width, self.geography.height)
 
 
     def s4_show_board_info(self):
@@ -55,8 +84,7 @@ class PMachine(FiniteStateMachine):
 
         print("After minute {}: ".format(self.minute))
 
-        for row in self.geography:
-            rowstr = "".join(row)
+        for rowstr in self.geography.to_lines():
             print(rowstr)
 
 
@@ -66,66 +94,23 @@ class PMachine(FiniteStateMachine):
         return self.minute >= self.target_minute
 
 
-    def get_adjacency_count(self, idx, jdx):
-
-        tcount = Counter()
-
-        for di in range(-1, +2):
-            for dj in range(-1, +2):
-                if di == 0 and dj == 0:
-                    continue
-
-                if idx+di < 0 or jdx+dj < 0:
-                    continue
-
-                try: 
-                    terrain = self.geography[idx+di][jdx+dj]
-                    tcount.update(terrain)
-                except IndexError:
-                    pass
-
-        if idx == 0 or jdx == 0:
-            assert sum(tcount.values()) <= 5
-
-        return tcount
-
-
-    def compute_new_state(self, idx, jdx):
-        adjcount = self.get_adjacency_count(idx, jdx)
-        current = self.geography[idx][jdx]
-
-        #if idx == 2 or idx == 1:
-        #    print("For position i={}, j={}, current={}, adjacency={}".format(idx, jdx, current, adjcount))
-
-
-        if current == '.':
-            return '|' if adjcount['|'] >= 3 else '.'
-
-        if current == '|':
-            return '#' if adjcount['#'] >= 3 else '|'
-
-        if current == '#':
-            acond = adjcount['#'] >= 1 and adjcount['|'] >= 1
-            return '#' if acond else '.'
-
-        assert False
-
-
     def s10_compose_new_geo(self):
 
-        self.new_geo = [copy.copy(row) for row in self.geography]
-
-        for idx in range(len(self.geography)):
-            for jdx in range(len(self.geography[0])):
-                newstat = self.compute_new_state(idx, jdx)
-                self.new_geo[idx][jdx] = newstat
-
-
+        # Whole-board step: tree and lumberyard counts for every cell in one pass, then each cell's
+        # (terrain, count flags) code goes through one lookup table, written into the back buffer in place.
+        # There are no per-cell Python objects, but each step does build a few board-sized temporaries:
+        # the translates and the big ints of the lane arithmetic
+        cells = self.geography.cells
+        countflags = self.lane_counter.count_weighted(cells, NEIGHBOR_WEIGHT_TABLE).translate(COUNT_FLAG_TABLE)
+        terrain = cells.translate(TERRAIN_CODE_TABLE)
 
+        ruleinput = int.from_bytes(countflags, 'little') | int.from_bytes(terrain, 'little')
+        self.new_geo.cells[:] = ruleinput.to_bytes(len(cells), 'little').translate(GROWTH_RULE_TABLE)
 
     def s12_replace_old_with_new(self):
 
-        self.geography = self.new_geo
+        # Double buffered, the old board becomes the next back buffer
+        self.geography, self.new_geo = self.new_geo, self.geography
 
     def s20_clock_tick(self):
         self.minute += 1
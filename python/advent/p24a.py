@@ -1,3 +1,4 @@
+import copy
 import json
 import time
 import sys
@@ -85,6 +86,10 @@ class BioGroup:
         print("Vulners are {}".format(self.vulns))
         """
 
+    def __deepcopy__(self, memo):
+        # Only the unit count changes in a battle, so a fork shares the parsed specials
+        return copy.copy(self)
+
     def is_immune(self):
         return self.group_id[0]
 
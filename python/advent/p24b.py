@@ -1,19 +1,31 @@
 import json
 import time
+import functools
 from collections import deque
 
 import utility as U
+import sweep
 from finite_state import *
 
 import p24a
 
 
-def result_at_boost(boost, tcode, verbose=False):
+def build_base_machine(tcode):
+    basemachine = p24a.PMachine()
+    basemachine.test_code = tcode
+    basemachine.run_until(lambda mach: len(mach.groups) > 0)
+    return basemachine
+
+
+def result_at_boost(boost, tcode, verbose=False, basemachine=None):
     alpha = time.time()
-    submachine = p24a.PMachine()
-    submachine.test_code = tcode
+
+    # Probes fork a machine that has already read the input, if one is given
+    if basemachine is None:
+        basemachine = build_base_machine(tcode)
+
+    submachine = basemachine.fork()
     submachine.verbose = verbose
-    submachine.run_until(lambda mach: len(mach.groups) > 0)
 
 
     for grp in submachine.groups.values():
@@ -30,6 +42,13 @@ def result_at_boost(boost, tcode, verbose=False):
     return submachine.immune_wins(), submachine.get_result()
 
 
+def find_min_boost(tcode, maxboost, workers=None):
+    # Draws count as losses. The bisection assumes a bigger boost never loses a battle that a smaller one won
+    basemachine = build_base_machine(tcode)
+    taskfunc = functools.partial(result_at_boost, tcode=tcode, basemachine=basemachine)
+    return sweep.bisect_first(taskfunc, 0, maxboost, predicate=lambda rslt: rslt[0], workers=workers)
+
+
 class PMachine(FiniteStateMachine):
     
     
@@ -49,15 +68,15 @@ class PMachine(FiniteStateMachine):
         self.test_code = None
 
     def get_result(self):
-        immwin, fresult = result_at_boost(self.boost_probe, self.test_code)
+        immwin, fresult = result_at_boost(self.boost_probe, self.test_code, basemachine=self.base_machine)
         assert immwin
         return fresult
 
     def s1_init_machine(self):
-        pass
+        self.base_machine = build_base_machine(self.test_code)
 
     def s16_is_immune_victory(self):
-        immwin, _ = result_at_boost(self.boost_probe, self.test_code)
+        immwin, _ = result_at_boost(self.boost_probe, self.test_code, basemachine=self.base_machine)
         if immwin:
             print("Found immune system win at boost={}".format(self.boost_probe))
 
@@ -87,6 +106,10 @@ def run_tests():
         assert exprslt == finalresult
     """
 
+    minboost, (_, finalresult) = find_min_boost('A', 2000)
+    print("Minimum boost for test A is {}, result={}".format(minboost, finalresult))
+    assert minboost == 1570 and finalresult == 51
+
     regular = [27]
 
     for boost in regular:
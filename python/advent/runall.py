@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import utility as U
+
+# Per-problem time limit for solve all / test all, in seconds
+RUN_ALL_TIMEOUT = 600
+
+# Wall times from previous runs, keyed by command then problem code, used to start the slowest problems first
+TIMING_FILE = "run_timings.json"
+
+RESULT_PREFIX = "Result is : "
+
+
+def get_timing_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), TIMING_FILE)
+
+
+def load_timings():
+
+    timingpath = get_timing_path()
+
+    if not os.path.exists(timingpath):
+        return {}
+
+    with open(timingpath) as fh:
+        return json.load(fh)
+
+
+def save_timings(command, records):
+
+    # A timed-out problem is recorded at the timeout, so it still goes out early next time
+    timings = load_timings()
+    cmdtimes = timings.setdefault(command, {})
+
+    for rec in records:
+        cmdtimes[rec["pcode"]] = rec["wall_secs"]
+
+    with open(get_timing_path(), 'w') as fh:
+        json.dump(timings, fh, indent=2, sort_keys=True)
+
+
+def get_run_order(command, pcodes):
+
+    # Longest expected first. Problems with no previous timing go first of all,
+    # since they could be the slowest; ties fall back to problem code order
+    cmdtimes = load_timings().get(command, {})
+    return sorted(pcodes, key=lambda pc: (-cmdtimes.get(pc, float("inf")), pc))
+
+
+def run_problem(command, pcode, timeout):
+
+    run = U.run_entry_command(command, pcode, timeout)
+    record = { "pcode" : pcode, "status" : run["status"], "wall_secs" : run["wall_secs"] }
+
+    if run["status"] == "error":
+        record["error"] = run["stderr_last"]
+
+    resultlines = [line for line in run["stdout_lines"] if line.startswith(RESULT_PREFIX)]
+
+    if run["status"] == "ok" and resultlines:
+        record["result"] = resultlines[-1][len(RESULT_PREFIX):].strip()
+
+    return record
+
+
+def run_all(command, workers=None, timeout=RUN_ALL_TIMEOUT):
+
+    # The threads only wait on the problem subprocesses, so workers is the number of problems running at once
+    numworker = os.cpu_count() if workers is None else workers
+    # Testing everything includes the tool modules that have their own tests
+    runcodes = U.get_problem_codes() + (U.TOOL_TEST_MODULES if command == "test" else [])
+    runorder = get_run_order(command, runcodes)
+    alpha = time.time()
+
+    def runone(pcode):
+        record = run_problem(command, pcode, timeout)
+        print("Finished {} {}, {} in {:.03f} secs".format(command, pcode, record["status"], record["wall_secs"]), file=sys.stderr)
+        return record
+
+    with ThreadPoolExecutor(max_workers=numworker) as pool:
+        records = list(pool.map(runone, runorder))
+
+    save_timings(command, records)
+
+    records = sorted(records, key=lambda rec: rec["pcode"])
+    return { "command" : command, "wall_secs" : time.time() - alpha, "workers" : numworker, "problems" : records }
+
+
+def get_report_lines(report):
+
+    yield "{:<6} {:<8} {:>10}  {}".format("pcode", "status", "secs", "result")
+
+    for rec in report["problems"]:
+        detail = rec.get("result", rec.get("error", ""))
+        yield "{:<6} {:<8} {:>10.03f}  {}".format(rec["pcode"], rec["status"], rec["wall_secs"], detail)
+
+    statuslist = [rec["status"] for rec in report["problems"]]
+    yield ""
+    yield "{} ok, {} errors, {} timeouts, {:.03f} secs total with {} workers".format(
+        statuslist.count("ok"), statuslist.count("error"), statuslist.count("timeout"), report["wall_secs"], report["workers"])
@@ -0,0 +1,187 @@
+import heapq
+import itertools
+
+import utility as U
+
+# Dijkstra, A* and multi-target search all run on search_core. Edge functions map a state
+# to an iterable of (next state, cost); succfunc-style functions used with the BFS helpers
+# return plain next states, and count every edge as cost 1.
+# Results are (goal, parents, dist): the goal reached or None, the parent of each state
+# reached (None for the starts), and the distance to each settled state. Use U.extract_path for the path
+
+
+def search_core(starts, edgefunc, goalfunc=None, heuristic=None):
+
+    # Best first search from any of the starts, with lazy deletion of stale heap entries.
+    # The heap is ordered on distance plus heuristic, then insertion order,
+    # so states themselves never need to be comparable. With no goalfunc,
+    # it settles everything reachable, which gives a full distance map
+    dist = {}
+    parents = {}
+    bestseen = {}
+    counter = itertools.count()
+    heap = []
+
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    for start in starts:
+        bestseen[start] = 0
+        parents[start] = None
+        heappush(heap, (0 if heuristic is None else heuristic(start), next(counter), 0, start))
+
+    while heap:
+
+        _, _, sdist, state = heappop(heap)
+
+        if state in dist:
+            continue
+
+        dist[state] = sdist
+
+        if goalfunc is not None and goalfunc(state):
+            return state, parents, dist
+
+        for nstate, cost in edgefunc(state):
+
+            ndist = sdist + cost
+
+            if nstate in dist or bestseen.get(nstate, ndist+1) <= ndist:
+                continue
+
+            bestseen[nstate] = ndist
+            parents[nstate] = state
+            priority = ndist if heuristic is None else ndist + heuristic(nstate)
+            heappush(heap, (priority, next(counter), ndist, nstate))
+
+    return None, parents, dist
+
+
+def dijkstra_search(start, edgefunc, goalfunc=None):
+    return search_core([start], edgefunc, goalfunc)
+
+
+def astar_search(start, edgefunc, goalfunc, heuristic):
+    # The heuristic must be consistent: for every edge a -> b, h(a) <= cost(a, b) + h(b).
+    # Settled states are never reopened, so a heuristic that only never overestimates
+    # the remaining cost is not enough, the path found may not be the shortest
+    return search_core([start], edgefunc, goalfunc, heuristic)
+
+
+def unit_edges(succfunc):
+    def edgefunc(state):
+        return [(nstate, 1) for nstate in succfunc(state)]
+    return edgefunc
+
+
+def multi_target_bfs(starts, succfunc, targets):
+    # Nearest of the targets from any of the starts; ties go to whichever was queued first
+    targetset = set(targets)
+    return search_core(starts, unit_edges(succfunc), targetset.__contains__)
+
+
+def manhattan_heuristic(goalpt):
+    def heuristic(pt):
+        return abs(pt[0] - goalpt[0]) + abs(pt[1] - goalpt[1])
+    return heuristic
+
+
+def bidirectional_bfs(start, goal, succfunc, predfunc=None):
+
+    # Shortest path from start to goal, growing a frontier from each end and always expanding
+    # the smaller one. predfunc gives the states leading into a state; leave it out when the
+    # moves are reversible. Returns the path as a list of states, or None
+    predfunc = succfunc if predfunc is None else predfunc
+
+    if start == goal:
+        return [start]
+
+    fwdparents = { start : None }
+    bwdparents = { goal : None }
+    fwddepth = { start : 0 }
+    bwddepth = { goal : 0 }
+    fwdlayer = [start]
+    bwdlayer = [goal]
+
+    while fwdlayer and bwdlayer:
+
+        forward = len(fwdlayer) <= len(bwdlayer)
+        layer = fwdlayer if forward else bwdlayer
+        myparents, mydepth = (fwdparents, fwddepth) if forward else (bwdparents, bwddepth)
+        otherdepth = bwddepth if forward else fwddepth
+        stepfunc = succfunc if forward else predfunc
+
+        # The whole layer is expanded before stopping, since the meeting point
+        # nearest the other end can turn up after the first one
+        nextlayer = []
+        meeting = None
+
+        for state in layer:
+            for nstate in stepfunc(state):
+                if nstate in myparents:
+                    continue
+                myparents[nstate] = state
+                mydepth[nstate] = mydepth[state] + 1
+                nextlayer.append(nstate)
+                if nstate in otherdepth and (meeting is None or otherdepth[nstate] < otherdepth[meeting]):
+                    meeting = nstate
+
+        if meeting is not None:
+            fwdpath = U.extract_path(meeting, fwdparents)
+            bwdpath = U.extract_path(meeting, bwdparents)
+            return fwdpath + list(reversed(bwdpath[:-1]))
+
+        if forward:
+            fwdlayer = nextlayer
+        else:
+            bwdlayer = nextlayer
+
+    return None
+
+
+def run_tests():
+
+    # A small maze, # is a wall
+    maze = [
+        "#########",
+        "#...#...#",
+        "#.#.#.#.#",
+        "#.#...#.#",
+        "#.#####.#",
+        "#.......#",
+        "#########",
+    ]
+
+    def succfunc(pt):
+        for dx, dy in ((0, -1), (-1, 0), (1, 0), (0, 1)):
+            npt = (pt[0]+dx, pt[1]+dy)
+            if maze[npt[1]][npt[0]] != '#':
+                yield npt
+
+    start, goal = (1, 1), (7, 1)
+
+    _, bfsparents = U.state_search(start, succfunc, lambda pt: pt == goal)
+    bfslen = len(U.extract_path(goal, bfsparents))
+
+    found, parents, dist = dijkstra_search(start, unit_edges(succfunc), lambda pt: pt == goal)
+    assert found == goal and dist[goal] == bfslen - 1 and len(U.extract_path(goal, parents)) == bfslen
+
+    found, parents, dist = astar_search(start, unit_edges(succfunc), lambda pt: pt == goal, manhattan_heuristic(goal))
+    assert found == goal and dist[goal] == bfslen - 1
+
+    path = bidirectional_bfs(start, goal, succfunc)
+    assert path[0] == start and path[-1] == goal and len(path) == bfslen
+
+    found, _, dist = multi_target_bfs([start], succfunc, [goal, (5, 1)])
+    assert found == (5, 1) and dist[found] == 8
+
+    # Weighted edges: the long way round is cheaper when the short way is expensive
+    graph = { 'a' : [('b', 10), ('c', 1)], 'b' : [('d', 1)], 'c' : [('b', 2)], 'd' : [] }
+    found, parents, dist = dijkstra_search('a', graph.get, lambda st: st == 'd')
+    assert dist['d'] == 4 and U.extract_path('d', parents) == ['a', 'c', 'b', 'd']
+
+    # Long paths must not hit the recursion limit
+    chain = { idx : idx - 1 if idx > 0 else None for idx in range(100000) }
+    assert len(U.extract_path(99999, chain)) == 100000
+
+    print("Search tests successful")
@@ -0,0 +1,208 @@
+import os
+import time
+import operator
+import functools
+import importlib
+import multiprocessing
+from contextlib import redirect_stdout
+
+import utility as U
+
+
+# Tasks are pickled over to worker processes, so they must be module-level functions,
+# functools.partial objects over them, or instances of classes like ProblemParamTask.
+# Results come back in parameter order regardless of which worker finished first.
+# Every entry point runs on a multiprocessing.Pool, terminated on the way out, so tasks never outlive the call
+
+
+def get_worker_count(workers=None):
+    return os.cpu_count() if workers is None else workers
+
+
+def sweep_values(taskfunc, values, workers=None):
+
+    # Run taskfunc on every value, returns a list of (value, result)
+    values = list(values)
+
+    with multiprocessing.Pool(processes=get_worker_count(workers)) as pool:
+        return list(zip(values, pool.map(taskfunc, values)))
+
+
+class IndexedTask:
+
+    # Wraps a task so results coming back out of order can be matched up with their value
+    def __init__(self, taskfunc):
+        self.task_func = taskfunc
+
+    def __call__(self, idxval):
+        idx, value = idxval
+        return idx, self.task_func(value)
+
+
+def find_first(taskfunc, values, predicate=bool, workers=None):
+
+    # First value, in the given order, whose result passes the predicate, as (value, result),
+    # or None if no value passes. Values go out to the workers in order; once some value passes
+    # and every value before it has failed, the pool is terminated, killing any tasks still running
+    values = list(values)
+    outcomes = [None] * len(values)
+    bestidx = len(values)
+    pool = multiprocessing.Pool(processes=get_worker_count(workers))
+
+    try:
+        for idx, result in pool.imap_unordered(IndexedTask(taskfunc), enumerate(values)):
+            outcomes[idx] = (predicate(result), result)
+
+            if outcomes[idx][0] and idx < bestidx:
+                bestidx = idx
+
+            if all([outcomes[pidx] is not None for pidx in range(bestidx)]):
+                break
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if bestidx == len(values):
+        return None
+
+    return values[bestidx], outcomes[bestidx][1]
+
+
+def bisect_first(taskfunc, lowval, highval, predicate=bool, workers=None):
+
+    # Smallest integer value in [lowval, highval] whose result passes the predicate, as (value, result),
+    # or None if highval fails. The predicate must be monotone: once a value passes, all higher values pass.
+    # Each round probes as many evenly spread values as there are workers, so the range shrinks
+    # by a factor of workers+1 per round instead of 2. A round is a find_first over its probes, so it ends
+    # as soon as the lowest passing probe is known, and the probes above it are killed
+    numworker = get_worker_count(workers)
+    passed = None
+
+    # Invariant: everything below lowval fails, and passed holds the result for highval+1 if known
+    while lowval <= highval:
+        span = highval - lowval + 1
+        probes = sorted(set([lowval + (span * (k+1)) // (numworker+1) for k in range(numworker)]))
+
+        found = find_first(taskfunc, probes, predicate=predicate, workers=numworker)
+
+        if found is None:
+            lowval = probes[-1] + 1
+            continue
+
+        pidx = probes.index(found[0])
+        lowval = lowval if pidx == 0 else probes[pidx-1] + 1
+        highval = found[0] - 1
+        passed = found
+
+    return passed
+
+
+class ProblemParamTask:
+
+    # Runs problem pcode to completion with the machine attribute paramname set to the swept value,
+    # e.g. elf_boost for p15a. Returns (result, check), where check is the return value of the
+    # checkname method of the finished machine, or None when there is no checkname.
+    # The result is only computed when there is no check or the check passes
+
+    def __init__(self, pcode, paramname, testcode=None, checkname=None):
+        self.pcode = pcode
+        self.param_name = paramname
+        self.test_code = testcode
+        self.check_name = checkname
+
+    def __call__(self, value):
+
+        pmod = importlib.import_module(self.pcode)
+        pmachine = pmod.PMachine()
+        pmachine.test_code = self.test_code
+        setattr(pmachine, self.param_name, value)
+
+        # Machines print progress as they go, which is just noise from many workers at once
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            pmachine.run2_completion()
+
+        check = None if self.check_name is None else getattr(pmachine, self.check_name)()
+
+        if check is None or check:
+            return pmachine.get_result(), check
+
+        return None, check
+
+
+def parse_param_spec(paramspec):
+
+    # name=lo:hi for an inclusive integer range, or name=a,b,c for a list of integers
+    assert "=" in paramspec, "Parameter spec must be name=lo:hi or name=a,b,c, got {}".format(paramspec)
+    paramname, valstr = paramspec.split("=", 1)
+
+    if ":" in valstr:
+        lowval, highval = [int(v) for v in valstr.split(":")]
+        return paramname, list(range(lowval, highval+1))
+
+    return paramname, [int(v) for v in valstr.split(",")]
+
+
+def run_sweep_command(pcode, arglist):
+
+    # entry.py sweep pXY --param name=spec [--test CODE] [--check METHOD] [--first | --bisect] [--workers N]
+    # --first and --bisect search for the first value whose check passes, --bisect requires a lo:hi range
+    paramname, values = parse_param_spec(U.get_option(arglist, "--param"))
+    workers = U.get_option(arglist, "--workers")
+    workers = None if workers is None else int(workers)
+
+    checkname = U.get_option(arglist, "--check")
+    taskfunc = ProblemParamTask(pcode, paramname, testcode=U.get_option(arglist, "--test"), checkname=checkname)
+
+    if "--first" in arglist or "--bisect" in arglist:
+        assert checkname is not None, "A search needs a --check method"
+
+        if "--bisect" in arglist:
+            found = bisect_first(taskfunc, values[0], values[-1], predicate=lambda rslt: rslt[1], workers=workers)
+        else:
+            found = find_first(taskfunc, values, predicate=lambda rslt: rslt[1], workers=workers)
+
+        if found is None:
+            print("No value of {} passed {}".format(paramname, checkname))
+        else:
+            print("First passing {}={}, result is : {}".format(paramname, found[0], found[1][0]))
+
+        return found
+
+    results = sweep_values(taskfunc, values, workers=workers)
+
+    for value, (result, check) in results:
+        checkstr = "" if checkname is None else ", {}={}".format(checkname, check)
+        print("{}={}, result={}{}".format(paramname, value, result, checkstr))
+
+    return results
+
+
+def pass_at_zero(value):
+    # Test task: zero passes at once, everything else takes a long time to fail
+    if value != 0:
+        time.sleep(60)
+    return value == 0
+
+
+def run_tests():
+
+    # find_first has to return once zero passes, without waiting out the slow tasks already running
+    alpha = time.time()
+    assert find_first(pass_at_zero, range(4), workers=4) == (0, True)
+    assert time.time() - alpha < 30, "find_first waited for the remaining tasks"
+
+    assert find_first(abs, [0, 0, 3, 5], workers=2) == (3, 3)
+    assert find_first(abs, [0, 0], workers=2) is None
+
+    # Probes above the lowest passing one are killed rather than waited for
+    alpha = time.time()
+    assert bisect_first(pass_at_zero, 0, 3, workers=4) == (0, True)
+    assert time.time() - alpha < 30, "bisect_first waited for the remaining probes"
+
+    for firstpass in [0, 1, 7, 50, 99, 100]:
+        assert bisect_first(functools.partial(operator.le, firstpass), 0, 99, workers=3) == ((firstpass, True) if firstpass < 100 else None)
+
+    assert sweep_values(abs, [-2, 1, -3], workers=2) == [(-2, 2), (1, 1), (-3, 3)]
+
+    print("Sweep tests successful")
@@ -1,17 +1,46 @@
 
 import os
+import re
 import sys
+import time
+import hashlib
+import subprocess
+from array import array
 from collections import deque
 
+# Optional, Grid.as_numpy needs it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PROBLEM_CODE_RE = r'^p(\d{2})([abc]?)$'
+
+# Tool modules with their own run_tests, run by entry.py test like the problems
+TOOL_TEST_MODULES = ["engine_tests", "query_trace", "search_util", "sweep"]
+
+# Neighbor steps as (dx, dy), in reading order
+ORTHOGONAL_STEPS = ((0, -1), (-1, 0), (1, 0), (0, 1))
+
+DIAGONAL_STEPS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+# Distance field value for cells that can't be reached
+UNREACHABLE = -1
+
+# Wall time spent loading inputs with read_input_deque, read by the bench harness
+INPUT_LOAD_TIMER = { "calls" : 0, "secs" : 0.0 }
+
 
 def extract_path(state, parents):
 
-    prnt = parents[state]
+    # Iterative, so long paths don't hit the recursion limit
+    path = [state]
 
-    if prnt == None:
-        return [state]
+    while parents[path[-1]] != None:
+        path.append(parents[path[-1]])
 
-    return extract_path(prnt, parents) + [state]
+    path.reverse()
+    return path
 
 
 def state_search(start, succfunc, goalfunc, breadth=True):
@@ -53,7 +82,248 @@ def state_search(start, succfunc, goalfunc, breadth=True):
 
 
 
+class Grid:
+
+    # Dense 2-D board of byte-sized cells, stored row-major in one bytearray:
+    # one byte per cell, against a dict entry or list slot plus a tuple or str per cell.
+    # Character boards store the character codes, see from_lines. Points are (x, y)
+
+    def __init__(self, width, height, fill=0, cells=None):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.cells = bytearray([fill]) * (width * height) if cells is None else cells
+        assert len(self.cells) == width * height, "Have {} cells for a {}x{} grid".format(len(self.cells), width, height)
+
+    @staticmethod
+    def from_lines(lines):
+        lines = list(lines)
+        width = max([len(line) for line in lines]) if lines else 0
+        cells = bytearray(b"".join([line.ljust(width).encode('ascii') for line in lines]))
+        return Grid(width, len(lines), cells=cells)
+
+    def to_lines(self):
+        return [self.get_row(yidx).decode('ascii') for yidx in range(self.height)]
+
+    def in_bounds(self, pt):
+        return 0 <= pt[0] < self.width and 0 <= pt[1] < self.height
+
+    def index(self, pt):
+        return pt[1] * self.width + pt[0]
+
+    def point(self, idx):
+        return (idx % self.width, idx // self.width)
+
+    def __getitem__(self, pt):
+        return self.cells[pt[1] * self.width + pt[0]]
+
+    def __setitem__(self, pt, value):
+        self.cells[pt[1] * self.width + pt[0]] = value
+
+    def get_char(self, pt):
+        return chr(self[pt])
+
+    def set_char(self, pt, char):
+        self[pt] = ord(char)
+
+    def neighbor_indices(self, idx, diagonal=False):
+
+        # In-bounds neighbors of a cell index, in reading order, which for indices is just increasing order.
+        # The orthogonal case is spelled out, it is the inner loop of the distance fields
+        width = self.width
+
+        if diagonal:
+            xidx, yidx = idx % width, idx // width
+            for dx, dy in DIAGONAL_STEPS:
+                if 0 <= xidx+dx < width and 0 <= yidx+dy < self.height:
+                    yield idx + dy * width + dx
+            return
+
+        if idx >= width:
+            yield idx - width
+        if idx % width != 0:
+            yield idx - 1
+        if idx % width != width - 1:
+            yield idx + 1
+        if idx + width < self.size:
+            yield idx + width
+
+    def neighbors(self, pt, diagonal=False):
+        for nidx in self.neighbor_indices(self.index(pt), diagonal):
+            yield self.point(nidx)
+
+    def get_row(self, yidx):
+        return bytes(self.cells[yidx * self.width:(yidx+1) * self.width])
+
+    def get_col(self, xidx):
+        return bytes(self.cells[xidx::self.width])
+
+    def count(self, value):
+        return self.cells.count(value)
+
+    def copy(self):
+        return Grid(self.width, self.height, cells=bytearray(self.cells))
+
+    def __eq__(self, other):
+        return isinstance(other, Grid) and (self.width, self.height, self.cells) == (other.width, other.height, other.cells)
+
+    # Grids are mutable, so they don't hash by value; use get_digest for state logs and cycle detection
+    __hash__ = None
+
+    def get_digest(self):
+        return hashlib.md5(self.width.to_bytes(4, 'little') + self.cells).hexdigest()
+
+    def as_numpy(self):
+        # A height x width uint8 view on the same memory, changes show up in both
+        assert numpy is not None, "NumPy is not installed"
+        return numpy.frombuffer(self.cells, dtype=numpy.uint8).reshape(self.height, self.width)
+
+
+class LaneCounter:
+
+    # Counts, for every cell of a width x height grid at once, how many of its 8 neighbors hold
+    # one of a set of values. Each cell is one byte lane of a big int, so the count is 8 shifted
+    # big int adds, all at C speed. Counts never pass 8, so lanes never carry into each other
+
+    def __init__(self, width, height):
+        self.width = width
+        self.size = width * height
+
+        def lanemask(keepfunc):
+            return int.from_bytes(bytes([0xFF if keepfunc(idx % width) else 0 for idx in range(self.size)]), 'little')
+
+        # A cell's left neighbor mustn't wrap round from the last column of the row above, and vice versa
+        self.mask_all = (1 << (8 * self.size)) - 1
+        self.mask_no_first = lanemask(lambda xidx: xidx != 0)
+        self.mask_no_last = lanemask(lambda xidx: xidx != width - 1)
+
+        self.table_cache = {}
+
+    def get_indicator_table(self, values):
+        values = frozenset(values)
+        if values not in self.table_cache:
+            self.table_cache[values] = bytes([1 if val in values else 0 for val in range(256)])
+        return self.table_cache[values]
+
+    def count(self, cells, values):
+        # Returns the counts as bytes, one per cell
+        return self.count_weighted(cells, self.get_indicator_table(values))
+
+    def count_weighted(self, cells, weighttable):
+
+        # Sum of weighttable[value] over each cell's 8 neighbors, as bytes. The weights must keep every sum
+        # below 256, e.g. 1 for one kind of cell and 16 for another counts both kinds at once in the two nibbles.
+        # Works straight off a bytearray; the translate and the big ints are the only board-sized temporaries
+        ind = int.from_bytes(cells.translate(weighttable), 'little')
+        fromleft = ind & self.mask_no_last
+        fromright = ind & self.mask_no_first
+
+        # A source cell at offset d from cell j lands on j by shifting it d lanes down
+        wid = 8 * self.width
+        total = (ind << wid) + (ind >> wid)
+        total += (fromleft << 8) + (fromleft << (wid + 8)) + (fromleft >> (wid - 8))
+        total += (fromright >> 8) + (fromright >> (wid + 8)) + (fromright << (wid - 8))
+
+        return (total & self.mask_all).to_bytes(self.size, 'little')
+
+
+def distance_field(grid, sources):
+
+    # Multi-source BFS over a Grid whose nonzero cells are blocked, e.g. walls and occupied cells.
+    # Cells are flat indices. Returns an array of the distance from the nearest source to each cell,
+    # UNREACHABLE where there is no path. Sources count as open even if blocked, e.g. the cell a unit is on
+    cells = grid.cells
+    dist = array('i', [UNREACHABLE]) * len(cells)
+    frontier = []
+
+    for src in sources:
+        if dist[src] == UNREACHABLE:
+            dist[src] = 0
+            frontier.append(src)
+
+    depth = 0
+
+    while frontier:
+        depth += 1
+        nextfront = []
+
+        for idx in frontier:
+            for nidx in grid.neighbor_indices(idx):
+                if dist[nidx] == UNREACHABLE and not cells[nidx]:
+                    dist[nidx] = depth
+                    nextfront.append(nidx)
+
+        frontier = nextfront
+
+    return dist
+
+
+def target_field(grid, targets):
+
+    # Distance field from a set of target cells that also labels each cell with its nearest target,
+    # ties broken in reading order, i.e. the lowest index. Built layer by layer, a cell takes the lowest
+    # label among its neighbors one layer closer. Returns (dist, label) arrays, label is -1 where unreachable.
+    # One field answers find_first_step for every unit heading for the same targets, until the grid changes
+    cells = grid.cells
+    dist = array('i', [UNREACHABLE]) * len(cells)
+    label = array('i', [-1]) * len(cells)
+    frontier = []
+
+    for tgt in sorted(targets):
+        if dist[tgt] == UNREACHABLE:
+            dist[tgt] = 0
+            label[tgt] = tgt
+            frontier.append(tgt)
+
+    depth = 0
+
+    while frontier:
+        depth += 1
+        nextfront = []
+
+        for idx in frontier:
+            for nidx in grid.neighbor_indices(idx):
+                if cells[nidx]:
+                    continue
+                if dist[nidx] == UNREACHABLE:
+                    dist[nidx] = depth
+                    label[nidx] = label[idx]
+                    nextfront.append(nidx)
+                elif dist[nidx] == depth and label[idx] < label[nidx]:
+                    label[nidx] = label[idx]
+
+        frontier = nextfront
+
+    return dist, label
+
+
+def step_from_field(grid, start, field):
+
+    # Combat-style move using a target_field: the nearest reachable target, ties broken in reading order,
+    # then the first step toward it, again ties in reading order. Returns (target, step) as flat indices,
+    # or None if no target is reachable. The start cell itself may be blocked, e.g. by the unit standing there.
+    # The nearest targets from the start are the nearest targets of its neighbors one step closer, so
+    # the lowest (distance, label, index) over the open neighbors picks both the target and the step
+    dist, label = field
+
+    if dist[start] == 0:
+        return start, start
+
+    steps = [(dist[nidx], label[nidx], nidx) for nidx in grid.neighbor_indices(start) if not grid.cells[nidx] and dist[nidx] != UNREACHABLE]
+
+    if not steps:
+        return None
+
+    _, target, step = min(steps)
+    return target, step
+
+
+def find_first_step(grid, start, targets):
+    return step_from_field(grid, start, target_field(grid, targets))
+
+
 def read_input_deque(pcode, dostrip=True):
+    alpha = time.time()
     indq = deque([])
     inputpath = os.path.join(get_data_dir(), '{}.txt'.format(pcode))
 
@@ -62,14 +332,18 @@ def read_input_deque(pcode, dostrip=True):
             line = line.strip() if dostrip else line
             indq.append(line)
 
+    INPUT_LOAD_TIMER["calls"] += 1
+    INPUT_LOAD_TIMER["secs"] += time.time() - alpha
     return indq
 
 
-def create_diagram(pmachine, pcode, keepgv=False):
-    gvpath = get_diagram_path(pcode, 'gv')
-    pngpath = get_diagram_path(pcode, 'png')
+def create_diagram(pmachine, pcode, keepgv=False, profiler=None):
+    # With a profiler, the diagram is heat-annotated and named pXY_heat
+    diagcode = pcode if profiler is None else "{}_heat".format(pcode)
+    gvpath = get_diagram_path(diagcode, 'gv')
+    pngpath = get_diagram_path(diagcode, 'png')
     graphlabel = "Machine_{}".format(pcode)
-    write_gv_output(pmachine.get_gv_tool(graphlabel=graphlabel), gvpath)
+    write_gv_output(pmachine.get_gv_tool(graphlabel=graphlabel, profiler=profiler), gvpath)
 
     dotcall = "dot {} -Tpng > {}".format(gvpath, pngpath)
     print(dotcall)
@@ -80,10 +354,22 @@ def create_diagram(pmachine, pcode, keepgv=False):
 
     return pngpath
 
+def get_option(arglist, flag, default=None):
+    # Value following a --flag in the command line arguments
+    return arglist[arglist.index(flag)+1] if flag in arglist else default
+
 def get_data_dir():
     basepath = os.path.dirname(__file__)
     return os.path.join(basepath, 'data')
 
+def get_checkpoint_path(pcode):
+    ckptdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoint')
+
+    if not os.path.exists(ckptdir):
+        os.makedirs(ckptdir)
+
+    return os.path.join(ckptdir, '{}.ckpt'.format(pcode))
+
 def get_diagram_path(pcode, extend):
     assert extend in ['gv', 'png']
 
@@ -105,11 +391,39 @@ def write_gv_output(gvtool, gvpath):
 
 
 
+def run_entry_command(command, pcode, timeout):
+
+    # Runs entry.py <command> pXY in its own interpreter, so a crash or a runaway machine only costs that problem.
+    # Returns a dict with status ok, error or timeout, the wall time, the stdout lines,
+    # and the last stderr line, which holds the exception for a crash
+    basepath = os.path.dirname(os.path.abspath(__file__))
+    cmdlist = [sys.executable, "entry.py", command, pcode]
+    alpha = time.time()
+
+    try:
+        result = subprocess.run(cmdlist, cwd=basepath, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return { "status" : "timeout", "wall_secs" : time.time() - alpha, "stdout_lines" : [], "stderr_last" : "" }
+
+    return {
+        "status" : "ok" if result.returncode == 0 else "error",
+        "wall_secs" : time.time() - alpha,
+        "stdout_lines" : result.stdout.strip().split("\n"),
+        "stderr_last" : result.stderr.strip().split("\n")[-1]
+    }
+
+
+def get_problem_codes():
+    basepath = os.path.dirname(os.path.abspath(__file__))
+    modnames = [fname[:-3] for fname in os.listdir(basepath) if fname.endswith(".py")]
+    return sorted([mname for mname in modnames if re.match(PROBLEM_CODE_RE, mname)])
+
+
 def check_problem_code(argstr):
 
-    for idx in range(1, 25):
-        for charcode in ['a', 'b', 'c']:
-            if argstr == "p{:02}{}".format(idx, charcode):
-                return argstr
+    matchdata = re.match(PROBLEM_CODE_RE, argstr)
+
+    if matchdata != None and 1 <= int(matchdata.group(1)) <= 25:
+        return argstr
 
     assert False, "Invalid problem code {}, format is pXY[a|b|c]".format(argstr)
\ No newline at end of file
@@ -6,6 +6,11 @@ import os, copy
 
 GV_NODE_SHAPE_LIST = ["box", "diamond", "ellipse"]
 
+def get_attr_str(attrmap):
+	if not attrmap:
+		return ""
+	return "[" + ", ".join(["{}=\"{}\"".format(k, v) for (k, v) in sorted(attrmap.items())]) + "]"
+
 class GraphVizTool:
 	
 	def __init__(self):
@@ -16,6 +21,10 @@ class GraphVizTool:
 		self.node_shape_map = {}
 		self.edge_label_map = {}
 		
+		# Extra Graphviz attributes, e.g. fill color and pen width for heat maps
+		self.node_attr_map = {}
+		self.edge_attr_map = {}
+		
 		self.prop_map = {}
 		
 		self.prop_map["graphname"] = "MyGraphName"
@@ -45,6 +54,14 @@ class GraphVizTool:
 		if label is not None:
 			self.edge_label_map[(srcnode, dstnode)] = label
 				
+	def set_node_attr(self, nodecode, attrname, attrval):
+		assert nodecode in self.node_set, "Bad Node {}".format(nodecode)
+		self.node_attr_map.setdefault(nodecode, {})[attrname] = attrval
+		
+	def set_edge_attr(self, srcnode, dstnode, attrname, attrval):
+		assert (srcnode, dstnode) in self.edge_set, "Bad Edge {} {}".format(srcnode, dstnode)
+		self.edge_attr_map.setdefault((srcnode, dstnode), {})[attrname] = attrval
+		
 	def get_node_list4_shape(self, gvshape):
 		return [k for (k,v) in self.node_shape_map.items() if v == gvshape]
 		
@@ -57,10 +74,16 @@ class GraphVizTool:
 			nodelist = self.get_node_list4_shape(nodeshape)
 			yield "node [shape={}] {}".format(nodeshape, "; ".join(nodelist))
 		
+		for (nodecode, attrmap) in self.node_attr_map.items():
+			yield "{} {};".format(nodecode, get_attr_str(attrmap))
+		
 		for (srcnode, dstnode) in self.edge_set:
+			attrmap = {}
 			labelstr = self.edge_label_map.get((srcnode, dstnode), "")
-			labelstr = "" if not labelstr else "[label={}]".format(labelstr)			
-			yield "{}->{} {};".format(srcnode, dstnode, labelstr)
+			if labelstr:
+				attrmap["label"] = labelstr
+			attrmap.update(self.edge_attr_map.get((srcnode, dstnode), {}))
+			yield "{}->{} {};".format(srcnode, dstnode, get_attr_str(attrmap))
 		
 		yield "overlap=false"
 		yield "label={}".format(self.prop_map.get("graphlabel"))
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import sys, json, time, random
+
+from finite_state import *
+from simple_collatz import CollSeqMachine
+from heap_sort_flow import HeapSortMachine
+
+class SpinMachine(FiniteStateMachine):
+	"""
+	Trivial counting loop, so the timing is dominated by engine overhead
+	"""
+	
+	def __init__(self, numspin):
+		
+		statemap = """
+		{
+			"HMS" : "F:SC",
+			"BC" : "HMS"
+		}
+		"""
+		
+		FiniteStateMachine.__init__(self, json.loads(statemap))
+		
+		self.num_spin = numspin
+		self.counter = 0
+	
+	def s1_init_machine(self):
+		pass
+	
+	def s2_have_more_spin(self):
+		return self.counter < self.num_spin
+	
+	def s3_bump_counter(self):
+		self.counter += 1
+	
+	def s4_spin_complete(self):
+		pass
+
+# Fused mode runs with checks off, with hot loops fused after a short warm-up
+MODE_LIST = ["interpreted", "compiled", "fused"]
+
+FUSION_WARMUP = 1000
+
+def time_machine_run(machine, modestr):
+
+	machine.set_compiled_mode(modestr != "interpreted")
+
+	alpha = time.time()
+
+	if modestr == "fused":
+		machine.set_check_level("off")
+		machine.run_n_steps(FUSION_WARMUP)
+		machine.enable_fusion()
+
+	machine.run2_completion()
+	elapsed = time.time() - alpha
+
+	return machine.step_count, elapsed
+
+def compare_dispatch(buildfunc, label):
+
+	results = {}
+
+	for modestr in MODE_LIST:
+		stepcount, elapsed = time_machine_run(buildfunc(), modestr)
+		results[modestr] = stepcount / elapsed
+		print("{}, {} mode: {} steps in {:.03f} secs, {:.0f} steps/sec".format(label, modestr, stepcount, elapsed, results[modestr]))
+
+	for modestr in MODE_LIST[1:]:
+		print("{}, {} speedup is {:.02f}x".format(label, modestr, results[modestr] / results["interpreted"]))
+
+def shuffled_list(size):
+	mylist = list(range(size))
+	random.shuffle(mylist)
+	return mylist
+
+
+if __name__ == "__main__":
+
+	numspin = int(sys.argv[1]) if len(sys.argv) >= 2 else 500000
+	targetvalue = int(sys.argv[2]) if len(sys.argv) >= 3 else 2000
+	heapsize = int(sys.argv[3]) if len(sys.argv) >= 4 else 10000
+
+	compare_dispatch(lambda: SpinMachine(numspin), "SpinMachine({})".format(numspin))
+	compare_dispatch(lambda: CollSeqMachine(targetvalue), "CollSeqMachine({})".format(targetvalue))
+	# Every mode sorts a copy of the same list, so the speedups compare like with like
+	heapinput = shuffled_list(heapsize)
+	compare_dispatch(lambda: HeapSortMachine(list(heapinput)), "HeapSortMachine({})".format(heapsize))
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import os, random, tempfile
+
+from finite_state import *
+from machine_codegen import build_machine_runner
+from query_trace import find_divergence
+from simple_collatz import CollSeqMachine
+from heap_sort_flow import HeapSortMachine
+from engine_bench import SpinMachine
+
+# Every way of running a machine has to agree with the plain interpreted loop:
+# same step count, same visit counts, same machine data at the end
+RUN_MODE_LIST = ["interpreted", "compiled", "sampled", "unchecked", "fused", "generated"]
+
+def get_machine_data(fsmachine):
+	return { k : v for k, v in fsmachine.__dict__.items() if k not in fsmachine.engine_attr_set }
+
+def get_run_outcome(fsmachine):
+	return fsmachine.step_count, list(fsmachine.visit_count_list), fsmachine.get_state(), get_machine_data(fsmachine)
+
+def run_in_mode(fsmachine, modestr):
+
+	if modestr == "generated":
+		build_machine_runner(fsmachine)(fsmachine)
+		return fsmachine
+
+	fsmachine.set_compiled_mode(modestr != "interpreted")
+
+	if modestr == "sampled":
+		fsmachine.set_check_level("sampled", sampleevery=7)
+
+	if modestr in ["unchecked", "fused"]:
+		fsmachine.set_check_level("off")
+
+	if modestr == "fused":
+		# Fusion picks its loops from the visit counts, so it needs a short warm-up
+		fsmachine.run_n_steps(200)
+		fsmachine.enable_fusion()
+
+	fsmachine.run2_completion()
+	return fsmachine
+
+def check_run_modes(buildfunc, label):
+
+	expected = get_run_outcome(run_in_mode(buildfunc(), "interpreted"))
+
+	for modestr in RUN_MODE_LIST[1:]:
+		outcome = get_run_outcome(run_in_mode(buildfunc(), modestr))
+		assert outcome[:3] == expected[:3], "{} in {} mode ran {}, expected {}".format(label, modestr, outcome[:3], expected[:3])
+		assert outcome[3] == expected[3], "{} in {} mode ended with different machine data".format(label, modestr)
+
+	print("{}: all run modes agree over {} steps".format(label, expected[0]))
+
+def check_checkpoint_round_trip(buildfunc, label, midstep):
+
+	expected = get_run_outcome(run_in_mode(buildfunc(), "interpreted"))
+
+	fsmachine = buildfunc()
+	fsmachine.run2_step_count(midstep)
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		ckptpath = os.path.join(tmpdir, "engine.ckpt")
+		fsmachine.save_checkpoint(ckptpath)
+		assert os.listdir(tmpdir) == ["engine.ckpt"], "Checkpoint left files behind: {}".format(os.listdir(tmpdir))
+		restored = load_checkpoint(ckptpath)
+
+	assert get_run_outcome(restored) == get_run_outcome(fsmachine), "{} restored at a different position".format(label)
+
+	forked = fsmachine.fork()
+
+	for copied in [restored, forked, fsmachine]:
+		copied.run2_completion()
+		assert get_run_outcome(copied) == expected, "{} resumed from step {} ended differently".format(label, midstep)
+
+	print("{}: checkpoint and fork from step {} finish the same".format(label, midstep))
+
+def check_time_travel(buildfunc, label, stepcounts):
+
+	# Going back and forth has to land on the same position as a fresh run to each step
+	fsmachine = buildfunc()
+	fsmachine.enable_time_travel(stepinterval=50, maxsnapshots=4)
+
+	for stepcount in stepcounts:
+		fsmachine.run2_step_count(stepcount)
+
+		fresh = buildfunc()
+		fresh.run2_step_count(stepcount)
+		assert get_run_outcome(fsmachine) == get_run_outcome(fresh), "{} differs after going to step {}".format(label, stepcount)
+
+	print("{}: time travel over steps {} matches fresh runs".format(label, stepcounts))
+
+def check_history_and_trace(buildfunc, label):
+
+	fsmachine = buildfunc()
+	history = fsmachine.enable_history(10)
+	trace = fsmachine.enable_trace(checkpointevery=16)
+	fsmachine.run2_completion()
+
+	# The last recorded step is the one that led into the end state, and the trace replays the whole run
+	laststep, lastid, _ = history.get_entries()[-1]
+	assert laststep == fsmachine.step_count - 1 and len(history) == 10
+
+	replayed = list(trace.iter_steps(fsmachine.dispatch_next))
+	assert len(replayed) == fsmachine.step_count and replayed[-1][1] == lastid
+
+	other = buildfunc()
+	assert find_divergence(trace, other.enable_trace(checkpointevery=16), fsmachine.dispatch_next) is not None
+	other.run2_completion()
+	assert find_divergence(trace, other.query_trace, fsmachine.dispatch_next) is None
+
+	print("{}: history and trace agree with the run".format(label))
+
+def check_watchdog():
+
+	fsmachine = SpinMachine(10**9)
+	fsmachine.enable_watchdog(sampleevery=1000, maxsteps=5000)
+
+	try:
+		fsmachine.run2_completion()
+	except AssertionError as ex:
+		assert "Step budget" in str(ex)
+		print("Watchdog stopped a runaway machine at step {}".format(fsmachine.step_count))
+		return
+
+	assert False, "Watchdog didn't stop the machine"
+
+def run_tests():
+
+	rng = random.Random(17)
+	heapinput = list(range(300))
+	rng.shuffle(heapinput)
+
+	builders = [
+		(lambda: SpinMachine(2000), "SpinMachine"),
+		(lambda: CollSeqMachine(60), "CollSeqMachine"),
+		(lambda: HeapSortMachine(list(heapinput)), "HeapSortMachine")
+	]
+
+	for buildfunc, label in builders:
+		check_run_modes(buildfunc, label)
+
+		# Positions spread over the run, out of order so time travel goes both ways
+		numstep = run_in_mode(buildfunc(), "interpreted").step_count
+		check_checkpoint_round_trip(buildfunc, label, numstep // 2 + 1)
+		check_time_travel(buildfunc, label, [numstep * 3 // 5, numstep // 9, numstep // 2 + 1, 35, numstep - 1])
+		check_history_and_trace(buildfunc, label)
+
+	check_watchdog()
+
+	print("Engine tests successful")
+
+
+if __name__ == "__main__":
+	run_tests()
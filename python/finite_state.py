@@ -3,12 +3,59 @@
 from __future__ import print_function
 
 import os, re, copy
-import sys
+import sys, time, math, pickle
+from collections import namedtuple
 
 from diagram_util import GraphVizTool
+from state_profiler import StateProfiler
+from visit_history import VisitHistory, DEFAULT_HISTORY_SIZE
+from query_trace import QueryTrace, DEFAULT_TRACE_CHECKPOINT
+from machine_codegen import find_cyclic_components, build_fused_loop
+from machine_check import check_dispatch_table
 
 STATE_FUNCTION_RE = r's(\d{1,3})_(.*)'
 
+# Per-step invariant checking: visit limits and the op/query return contract.
+# Sampled checks every Nth step, off checks the visit limits once at the end of run2_completion
+CHECK_LEVEL_LIST = ["full", "sampled", "off"]
+
+DEFAULT_CHECK_SAMPLE = 1000
+
+# Visit limit for states that don't have one
+NO_VISIT_LIMIT = sys.maxsize
+
+# Next periodic task step when no periodic tasks are registered, the step count never gets there
+NO_TASK_STEP = -1
+
+# Time travel keeps a fork of the machine every so many steps, and thins them out past the limit
+DEFAULT_SNAPSHOT_INTERVAL = 10000
+
+DEFAULT_SNAPSHOT_LIMIT = 64
+
+# Watchdog defaults: steps between samples, and samples without progress before it aborts the run
+DEFAULT_WATCHDOG_SAMPLE = 100000
+
+DEFAULT_WATCHDOG_WINDOW = 50
+
+# Checkpoints are timed by the wall clock: every so many steps the clock is read, and a save is due once
+# the minimum gap has passed, or the cost ratio times the last save's wall time if that's longer,
+# which keeps saving to about 1/ratio of the run however big the machine is
+DEFAULT_CHECKPOINT_POLL = 100000
+
+DEFAULT_CHECKPOINT_SECS = 60
+
+CHECKPOINT_COST_RATIO = 50
+
+# Fingerprints kept by cycle detection before the log is cleared, cycles longer than this aren't found
+DEFAULT_CYCLE_LOG_SIZE = 100000
+
+# A detected cycle: step where the repeated configuration was first logged,
+# cycle length in steps, and the number of sync state visits per cycle
+CycleInfo = namedtuple("CycleInfo", ["start_step", "period_steps", "period_syncs"])
+
+# Result of a batched run: number of steps taken, state name at the end, and wall time in seconds
+RunSummary = namedtuple("RunSummary", ["steps", "final_state", "elapsed"])
+
 def get_basic_name(functionref):
 	return re.match(STATE_FUNCTION_RE, functionref.__name__).group(2)
 
@@ -31,13 +78,19 @@ def basic2_camel(basicname):
 def is_end_state_name(functionref):
 	return any([get_basic_name(functionref).endswith(suffstr) for suffstr in ["_complete", "_end"]])
 
-def create_diagram(fsmachine, outputdir, keepgv=False):
+def load_checkpoint(inpath):
+	
+	# The machine's module must be importable, the pickle refers to its class
+	with open(inpath, 'rb') as fh:
+		return pickle.load(fh)
+
+def create_diagram(fsmachine, outputdir, keepgv=False, profiler=None):
 	
 	assert os.path.exists(outputdir) and os.path.isdir(outputdir), "Problem with output directory {}".format(outputdir)
 
 	print("Going to create diagram in director {}".format(outputdir))
 	
-	gvtool = fsmachine.get_gv_tool()
+	gvtool = fsmachine.get_gv_tool(profiler=profiler)
 	
 	gvpath = os.path.join(outputdir, "StateThing.gv")
 	pngpath = os.path.join(outputdir, "StateThing.png")
@@ -52,34 +105,70 @@ def create_diagram(fsmachine, outputdir, keepgv=False):
 
 
 
-class FiniteStateMachine:
+class StateClassInfo:
+	
+	# State discovery and the parsed transition DSL for one machine class.
+	# Built once per class, holds the plain (unbound) state functions;
+	# instances bind to it by looking up their bound methods by name
+	
+	def __init__(self, machineclass):
 		
-	def __init__(self, smap):
-			
+		self.machine_name = "{}.{}".format(machineclass.__module__, machineclass.__name__)
 		self.state_list = []
 		self.acro2_func_map = {}
-		self.name2_func_map = {}	
+		self.name2_func_map = {}
 		
-		self.transition_map = {}
+		# Parsed transition info, keyed on the state map items
+		self.transition_cache = {}
 		
+		slist = []
 		
-		self.exact_visit_map = {}
-		self.max_visit_map = {}
+		for oneitem in dir(machineclass):
+						
+			matchdata = re.match(STATE_FUNCTION_RE, oneitem)
 			
-		self.step_count = 0
-
-		self.__init_state_info()
+			if matchdata == None: 
+				continue
+				
+			functionref = getattr(machineclass, oneitem)
+			functionidx = int(matchdata.group(1))
+			basicname = matchdata.group(2)
+			
+			slist.append((functionidx, functionref))
+			self.name2_func_map[basicname] = functionref
+			self.acro2_func_map[basic2_acro(basicname)] = functionref
 				
-		self.build_transition_map(smap)
 
-		self.show_transition_map()
+		idxes = [idx for idx, _ in slist]
+		if len(set(idxes)) < len(idxes):
+			for prbidx in idxes:
+				if len([myidx for myidx in idxes if myidx == prbidx]) > 1:
+					print("Error: Have repeated function index: {}".format(prbidx), file=sys.stderr)
+			assert False, "Repeated function indexes"
+
+
+		for (fidx, fref) in sorted(slist, key=lambda pr: pr[0]):
+			self.state_list.append(fref)
+	
+	def get_transition_info(self, smap):
 		
-		self.cur_state_func = self.state_list[0]
+		smapkey = tuple(sorted(smap.items()))
 		
-		self.state_visit_count = dict([(sfunc, 0) for sfunc in self.state_list])
-
-	def build_transition_map(self, smap):
+		if not smapkey in self.transition_cache:
+			self.transition_cache[smapkey] = self.build_transition_info(smap)
+			
+			# Wiring problems are reported once per class and state map, they don't stop construction
+			for problem in check_dispatch_table([sfunc.__name__ for sfunc in self.state_list], self.transition_cache[smapkey][2]):
+				print("Warning: {}: {}".format(self.machine_name, problem), file=sys.stderr)
+			
+		return self.transition_cache[smapkey]
+	
+	def build_transition_info(self, smap):
+		
+		# Returns the transition map over the unbound state functions,
+		# the state type for each state ID and the successor table for the dispatch loop
 		
+		transition_map = {}
 		
 		for key in smap:
 			assert key in self.acro2_func_map or key in self.name2_func_map, "No function found for state {}".format(key)
@@ -94,14 +183,14 @@ class FiniteStateMachine:
 			
 			for codeword in [get_acro_name(statefunc), get_basic_name(statefunc)]:
 				if codeword in smap:
-					self.transition_map[statefunc] = self.interpret_transition_code(smap[codeword], default_next)
+					transition_map[statefunc] = self.interpret_transition_code(smap[codeword], default_next)
 			
 			if is_end_state_name(statefunc):
-				self.transition_map[statefunc] = 0
+				transition_map[statefunc] = 0
 			
-			if not statefunc in self.transition_map:
+			if not statefunc in transition_map:
 				assert default_next is not None, "No default available for state {}".format(get_acro_name(statefunc))
-				self.transition_map[statefunc] = default_next
+				transition_map[statefunc] = default_next
 
 		def statetype(trans):
 			if trans == 0:
@@ -109,9 +198,27 @@ class FiniteStateMachine:
 			if type(trans) == dict:
 				return "query"
 			return "op"
-
-		self.state_type_map = { sfunc : statetype(trns) for sfunc, trns in self.transition_map.items() }
-				
+		
+		state_type_list = [statetype(transition_map[sfunc]) for sfunc in self.state_list]
+		
+		# For each state ID, the successor: an ID for op states,
+		# or a (false ID, true ID) pair for query states, indexed by the query result.
+		# None for end states
+		state_id_map = { sfunc : sidx for sidx, sfunc in enumerate(self.state_list) }
+		dispatch_next = []
+		
+		for statefunc, statetype in zip(self.state_list, state_type_list):
+			
+			transition = transition_map[statefunc]
+			
+			if statetype == "end":
+				dispatch_next.append(None)
+			elif statetype == "op":
+				dispatch_next.append(state_id_map[transition])
+			else:
+				dispatch_next.append((state_id_map[transition[False]], state_id_map[transition[True]]))
+		
+		return transition_map, state_type_list, dispatch_next
 			
 	def interpret_transition_code(self, strcode, default_next):
 		
@@ -141,40 +248,226 @@ class FiniteStateMachine:
 				return amap[strcode]
 			
 		assert False, "No state found corresponding to strcode {}".format(strcode)
-						
-				
-	def __init_state_info(self):
+
+
+class FiniteStateMachine:
+	
+	def __init_subclass__(cls, **kwargs):
 		
-		slist = []
+		# State discovery runs once, when the machine class is defined
+		super().__init_subclass__(**kwargs)
+		cls.state_class_info = StateClassInfo(cls)
 		
-		for oneitem in dir(self):
-						
-			matchdata = re.match(STATE_FUNCTION_RE, oneitem)
-			
-			if matchdata == None: 
-				continue
-				
-			functionref = getattr(self, oneitem)
-			functionidx = int(matchdata.group(1))
-			basicname = matchdata.group(2)
+	def __init__(self, smap):
+		
+		# Kept so a checkpointed machine can rebuild its transitions on restore
+		self.transition_dsl = smap
+		
+		self.exact_visit_map = {}
+		self.max_visit_map = {}
 			
-			slist.append((functionidx, functionref))
-			self.name2_func_map[basicname] = functionref
-			self.acro2_func_map[basic2_acro(basicname)] = functionref
+		self.step_count = 0
+
+		self.bind_state_info()
 				
+		self.build_transition_map(smap)
 
-		idxes = [idx for idx, _ in slist]
-		if len(set(idxes)) < len(idxes):
-			for prbidx in idxes:
-				if len([myidx for myidx in idxes if myidx == prbidx]) > 1:
-					print("Error: Have repeated function index: {}".format(prbidx), file=sys.stderr)
-			assert False, "Repeated function indexes"
+		self.show_transition_map()
+		
+		self.cur_state_func = self.state_list[0]
+		
+		# Compiled mode runs the machine off the integer dispatch table;
+		# turn it off to step through the original interpreted loop
+		self.compiled_mode = True
+		
+		self.visit_count_list = [0] * len(self.state_list)
+		
+		# Max allowed visits per state ID, so a step only checks the state it enters
+		self.visit_limit_list = [NO_VISIT_LIMIT] * len(self.state_list)
+		
+		self.set_check_level("full")
+		
+		# Opt-in, see enable_profiler, enable_history and enable_trace.
+		# Any one of them switches the run loops to the wrapped dispatch table
+		self.profiler = None
+		self.history = None
+		self.query_trace = None
+		self.wrapped_func = None
+		
+		# Opt-in, see enable_fusion
+		self.fused_table = None
+		self.fused_abort_state = None
+		
+		# Each task is [step interval, next step, task function], see add_periodic_task
+		self.periodic_task_list = []
+		self.next_task_step = NO_TASK_STEP
+		
+		# Opt-in, see enable_cycle_detection
+		self.cycle_sync_id = None
+		self.cycle_fingerprint = None
+		self.cycle_skip_func = None
+		self.cycle_log_size = DEFAULT_CYCLE_LOG_SIZE
+		self.cycle_log = {}
+		self.cycle_info = None
+		self.cycle_start_visits = None
+		
+		# Opt-in, see enable_time_travel. Sorted by step
+		self.snapshot_list = []
+		self.snapshot_limit = DEFAULT_SNAPSHOT_LIMIT
+		self.snapshot_task = None
+		self.watchdog_task = None
+		
+		# Machine data shared by reference between forks, see set_fork_shared
+		self.fork_shared_set = frozenset()
+		
+		# Everything set up to here belongs to the engine, the rest is machine data.
+		# Only the machine data and the run position go into a checkpoint
+		self.engine_attr_set = frozenset(self.__dict__) | frozenset(["engine_attr_set"])
 
+	def __getstate__(self):
+		
+		ckpt = self.get_run_position()
+		ckpt["machine_data"] = { k : v for k, v in self.__dict__.items() if k not in self.engine_attr_set }
+		return ckpt
+	
+	def __setstate__(self, ckpt):
+		
+		FiniteStateMachine.__init__(self, ckpt["transition_dsl"])
+		
+		self.__dict__.update(ckpt["machine_data"])
+		self.restore_run_position(ckpt)
+	
+	def __deepcopy__(self, memo):
+		
+		# Same as a checkpoint restore, but the engine setup comes from the class cache
+		# and the attributes declared with set_fork_shared go across by reference.
+		# A machine nested inside the machine data, e.g. a sub-machine, forks the same way
+		fork = object.__new__(type(self))
+		memo[id(self)] = fork
+		
+		for aname in self.fork_shared_set:
+			sharedobj = self.__dict__[aname]
+			memo[id(sharedobj)] = sharedobj
+		
+		FiniteStateMachine.__init__(fork, self.transition_dsl)
+		
+		machinedata = { k : v for k, v in self.__dict__.items() if k not in self.engine_attr_set }
+		
+		# Frozen machine data, e.g. parsed input, is shared without being declared
+		for avalue in machinedata.values():
+			if type(avalue) is frozenset:
+				memo[id(avalue)] = avalue
+		
+		fork.__dict__.update(copy.deepcopy(machinedata, memo))
+		fork.restore_run_position(self.get_run_position())
+		return fork
+	
+	def get_run_position(self):
+		
+		return {
+			"transition_dsl" : self.transition_dsl,
+			"state_name" : self.get_state(),
+			"step_count" : self.step_count,
+			"visit_count_list" : self.visit_count_list,
+			"max_visit_map" : { sfunc.__name__ : nvisit for sfunc, nvisit in self.max_visit_map.items() },
+			"exact_visit_map" : { sfunc.__name__ : nvisit for sfunc, nvisit in self.exact_visit_map.items() },
+			"check_level" : self.check_level,
+			"check_interval" : self.check_interval,
+			"check_countdown" : self.check_countdown,
+			"compiled_mode" : self.compiled_mode,
+			"fork_shared_set" : self.fork_shared_set,
+			"cycle_setup" : self.get_cycle_setup()
+		}
+	
+	def restore_run_position(self, ckpt):
+		
+		self.cur_state_func = getattr(self, ckpt["state_name"])
+		self.step_count = ckpt["step_count"]
+		self.visit_count_list[:] = ckpt["visit_count_list"]
+		
+		for sname, nvisit in ckpt["max_visit_map"].items():
+			self.set_max_allowed_visit(get_basic_name(getattr(self, sname)), nvisit)
+		
+		for sname, nvisit in ckpt["exact_visit_map"].items():
+			self.set_exact_visit_count(get_basic_name(getattr(self, sname)), nvisit)
+		
+		self.check_level = ckpt["check_level"]
+		self.check_interval = ckpt["check_interval"]
+		self.check_countdown = ckpt["check_countdown"]
+		self.compiled_mode = ckpt["compiled_mode"]
+		self.fork_shared_set = ckpt.get("fork_shared_set", frozenset())
+		self.restore_cycle_setup(ckpt.get("cycle_setup"))
+	
+	def set_fork_shared(self, *attrnames):
+		
+		# Declare machine data that is never modified after setup, e.g. the walls of a map,
+		# so forks share it instead of copying it. Frozensets are always shared. Objects inside
+		# the machine data can give their own __deepcopy__, e.g. a shallow copy when all they
+		# hold besides parsed input is numbers
+		self.fork_shared_set = self.fork_shared_set | frozenset(attrnames)
+	
+	def fork(self):
+		
+		# A new machine at the current step, which runs on independently of this one.
+		# Profiler, fused loops and periodic tasks stay with the original
+		return copy.deepcopy(self)
 
-		for (fidx, fref) in sorted(slist, key=lambda pr: pr[0]):
-			self.state_list.append(fref)
+	@property
+	def state_visit_count(self):
+		return { sfunc : self.visit_count_list[sidx] for sidx, sfunc in enumerate(self.state_list) }
+	
+	def bind_state_info(self):
+		
+		classinfo = self.state_class_info
+		
+		self.state_list = [getattr(self, sfunc.__name__) for sfunc in classinfo.state_list]
+		
+		# State IDs are positions in the state_list
+		self.state_id_map = { sfunc : sidx for sidx, sfunc in enumerate(self.state_list) }
+		
+		bindmap = dict(zip(classinfo.state_list, self.state_list))
+		
+		self.acro2_func_map = { acro : bindmap[sfunc] for acro, sfunc in classinfo.acro2_func_map.items() }
+		self.name2_func_map = { name : bindmap[sfunc] for name, sfunc in classinfo.name2_func_map.items() }
 
+	def build_transition_map(self, smap):
+		
+		# The parsed transitions come from the class cache, here they are
+		# translated from the unbound functions to this instance's bound methods
+		transition_map, state_type_list, dispatch_next = self.state_class_info.get_transition_info(smap)
+		
+		bindmap = dict(zip(self.state_class_info.state_list, self.state_list))
+		
+		def bindtrans(trans):
+			if trans == 0:
+				return 0
+			if type(trans) == dict:
+				return { tfval : bindmap[sfunc] for tfval, sfunc in trans.items() }
+			return bindmap[trans]
+		
+		self.transition_map = { bindmap[sfunc] : bindtrans(trns) for sfunc, trns in transition_map.items() }
+		
+		self.state_type_map = dict(zip(self.state_list, state_type_list))
+		
+		# For each state ID, dispatch_func holds the bound method (None for end states)
+		# and dispatch_next the successor, see StateClassInfo.build_transition_info.
+		# The successor table only holds IDs, so it is shared by all instances
+		self.dispatch_func = [None if stype == "end" else sfunc for sfunc, stype in zip(self.state_list, state_type_list)]
+		self.dispatch_next = dispatch_next
+		
+	def lookup_state_name(self, strcode):
+		
+		for amap in [self.acro2_func_map, self.name2_func_map]:
+			if strcode in amap:
+				return amap[strcode]
+			
+		assert False, "No state found corresponding to strcode {}".format(strcode)
 				
+	def check_wiring(self):
+		
+		# Problems found by the static check, see machine_check
+		return check_dispatch_table([sfunc.__name__ for sfunc in self.state_list], self.dispatch_next)
+	
 	def show_transition_map(self):
 		
 		#print("--------\nTransition Map:")
@@ -201,6 +494,7 @@ class FiniteStateMachine:
 		for namemap in [self.acro2_func_map, self.name2_func_map]:
 			if statecode in namemap:
 				self.max_visit_map[namemap[statecode]] = numvisit
+				self.visit_limit_list[self.state_id_map[namemap[statecode]]] = numvisit
 				return
 
 		assert False, "StateCode {} not found in either basic or ACRO state map".format(statecode)
@@ -215,7 +509,7 @@ class FiniteStateMachine:
 	
 	def set_state(self, statefunc):
 		
-		assert statefunc in self.state_map, "Unknown state function {}".format(statefunc.__name__)
+		assert statefunc in self.state_id_map, "Unknown state function {}".format(statefunc.__name__)
 	
 		self.cur_state_func = statefunc
 	
@@ -225,8 +519,410 @@ class FiniteStateMachine:
 	def get_state_type(self, statefunc):
 		return self.state_type_map[statefunc]
 
+	def set_compiled_mode(self, compiled):
+		self.compiled_mode = compiled
+	
+	def enable_profiler(self, profiler=None):
+		
+		# Pass the parent machine's profiler to a sub-machine to get nested timings.
+		# The run loop switches to the timed dispatch table, so there is no cost while disabled
+		self.profiler = StateProfiler() if profiler is None else profiler
+		self.build_wrapped_dispatch()
+		
+		return self.profiler
+	
+	def disable_profiler(self):
+		self.profiler = None
+		self.build_wrapped_dispatch()
+	
+	def enable_history(self, size=DEFAULT_HISTORY_SIZE):
+		
+		# Keep the last size (step, state ID, query result) entries, see VisitHistory
+		self.history = VisitHistory(size)
+		self.build_wrapped_dispatch()
+		
+		return self.history
+	
+	def disable_history(self):
+		self.history = None
+		self.build_wrapped_dispatch()
+	
+	def enable_trace(self, checkpointevery=DEFAULT_TRACE_CHECKPOINT):
+		
+		# Record query results from here on, see QueryTrace
+		self.query_trace = QueryTrace(self.step_count, self.state_id_map[self.cur_state_func], checkpointevery)
+		self.build_wrapped_dispatch()
+		
+		return self.query_trace
+	
+	def disable_trace(self):
+		self.query_trace = None
+		self.build_wrapped_dispatch()
+	
+	def build_wrapped_dispatch(self):
+		
+		# History and trace record outside the profiler, so their bookkeeping isn't counted as state time
+		wrapperlist = [wrapper for wrapper in [self.profiler, self.history, self.query_trace] if wrapper is not None]
+		
+		if not wrapperlist:
+			self.wrapped_func = None
+			return
+		
+		functable = list(self.dispatch_func)
+		
+		for wrapper in wrapperlist:
+			functable = [None if sfunc is None else wrapper.wrap_state(self, sidx, sfunc) for sidx, sfunc in enumerate(functable)]
+		
+		self.wrapped_func = functable
+	
+	def add_periodic_task(self, stepinterval, taskfunc):
+		
+		# Run taskfunc every stepinterval steps, between steps. The run loops compare
+		# the step count against the next task step, so this costs nothing in between
+		assert stepinterval >= 1, "Task interval must be positive, got {}".format(stepinterval)
+		
+		self.periodic_task_list.append([stepinterval, self.step_count + stepinterval, taskfunc])
+		self.reschedule_periodic_tasks()
+	
+	def remove_periodic_task(self, taskfunc):
+		
+		self.periodic_task_list = [task for task in self.periodic_task_list if task[2] != taskfunc]
+		self.reschedule_periodic_tasks()
+	
+	def reschedule_periodic_tasks(self):
+		
+		# Tasks that fell behind the step count, e.g. after a restore, are due at the next step
+		for task in self.periodic_task_list:
+			task[1] = max(task[1], self.step_count)
+		
+		self.next_task_step = min([task[1] for task in self.periodic_task_list] + [sys.maxsize])
+		
+		if self.next_task_step == sys.maxsize:
+			self.next_task_step = NO_TASK_STEP
+			
+		return self.next_task_step
+	
+	def run_periodic_tasks(self):
+		
+		for task in list(self.periodic_task_list):
+			if task[1] <= self.step_count:
+				task[1] = self.step_count + task[0]
+				task[2]()
+		
+		return self.reschedule_periodic_tasks()
+	
+	def enable_checkpoints(self, outpath, minsecs=DEFAULT_CHECKPOINT_SECS, pollevery=DEFAULT_CHECKPOINT_POLL):
+		
+		lastsave = time.time()
+		savecost = 0.0
+		
+		def checkpoint_task():
+			nonlocal lastsave, savecost
+			
+			now = time.time()
+			if now - lastsave < max(minsecs, savecost * CHECKPOINT_COST_RATIO):
+				return
+			
+			try:
+				self.save_checkpoint(outpath)
+			except (pickle.PicklingError, RecursionError, TypeError, AttributeError) as ex:
+				# Don't take down a long run over a checkpoint, just stop taking them.
+				# Local objects like lambdas raise AttributeError
+				print("Checkpoint at step {} failed, disabling checkpoints: {}".format(self.step_count, ex), file=sys.stderr)
+				self.remove_periodic_task(checkpoint_task)
+				return
+			
+			lastsave = time.time()
+			savecost = lastsave - now
+		
+		self.add_periodic_task(pollevery, checkpoint_task)
+	
+	def save_checkpoint(self, outpath):
+		
+		# Write a temp file and rename it, so a crash mid-write keeps the previous checkpoint
+		tmppath = outpath + ".tmp"
+		
+		try:
+			with open(tmppath, 'wb') as fh:
+				pickle.dump(self, fh, protocol=pickle.HIGHEST_PROTOCOL)
+			
+			os.replace(tmppath, outpath)
+		finally:
+			# Only left behind if the write failed
+			if os.path.exists(tmppath):
+				os.remove(tmppath)
+	
+	def enable_time_travel(self, stepinterval=DEFAULT_SNAPSHOT_INTERVAL, maxsnapshots=DEFAULT_SNAPSHOT_LIMIT):
+		
+		# Keep forks of the machine every stepinterval steps, so run2_step_count can go back to an earlier step
+		# by restoring the nearest snapshot at or before it and replaying forward. Replay re-runs the states,
+		# so the machine must be deterministic. Past maxsnapshots, every other snapshot is dropped
+		# and the interval doubles, which keeps memory bounded on long runs
+		self.snapshot_limit = maxsnapshots
+		self.snapshot_list = [self.fork()]
+		
+		def snapshot_task():
+			self.snapshot_list.append(self.fork())
+			
+			if len(self.snapshot_list) > self.snapshot_limit:
+				self.snapshot_list = self.snapshot_list[::2]
+				for task in self.periodic_task_list:
+					if task[2] == snapshot_task:
+						task[0] *= 2
+		
+		self.add_periodic_task(stepinterval, snapshot_task)
+		self.snapshot_task = snapshot_task
+	
+	def disable_time_travel(self):
+		
+		self.remove_periodic_task(self.snapshot_task)
+		self.snapshot_list = []
+	
+	def restore_snapshot(self, stepnum):
+		
+		# Put the machine back to the latest snapshot at or before stepnum, in place,
+		# so references to this machine stay good. The snapshot itself is left as it was
+		candidates = [snap for snap in self.snapshot_list if snap.step_count <= stepnum]
+		assert candidates, "No snapshot at or before step {}, enable_time_travel first".format(stepnum)
+		
+		restored = candidates[-1].fork()
+		restoredata = { k : v for k, v in restored.__dict__.items() if k not in restored.engine_attr_set }
+		
+		for aname in [k for k in self.__dict__ if k not in self.engine_attr_set and k not in restoredata]:
+			del self.__dict__[aname]
+		
+		self.__dict__.update(restoredata)
+		self.restore_run_position(restored.get_run_position())
+		self.reschedule_periodic_tasks()
+	
+	def enable_watchdog(self, sampleevery=DEFAULT_WATCHDOG_SAMPLE, progressfunc=None, window=DEFAULT_WATCHDOG_WINDOW, maxsteps=None, maxsecs=None):
+		
+		# Every sampleevery steps, check the step and wall time budgets, and sample progressfunc(),
+		# a cheap metric that changes as the machine gets somewhere, e.g. a generation counter.
+		# If it hasn't changed over window samples in a row, or a budget is used up, the run aborts
+		# with a report of where the machine is spinning. Budgets are checked at the samples. Runs as a periodic task,
+		# so the run loops only pay their usual next-task comparison
+		startstep = self.step_count
+		starttime = time.time()
+		lastprogress = None if progressfunc is None else progressfunc()
+		stallstep = self.step_count
+		stallvisits = list(self.visit_count_list)
+		numstall = 0
+		
+		def watchdog_task():
+			nonlocal lastprogress, stallstep, stallvisits, numstall
+			
+			if maxsteps is not None and self.step_count - startstep >= maxsteps:
+				assert False, self.get_watchdog_report("Step budget of {} used up".format(maxsteps), stallstep, stallvisits)
+			
+			if maxsecs is not None and time.time() - starttime >= maxsecs:
+				assert False, self.get_watchdog_report("Time budget of {} secs used up".format(maxsecs), stallstep, stallvisits)
+			
+			if progressfunc is None:
+				return
+			
+			progress = progressfunc()
+			
+			if progress != lastprogress:
+				lastprogress = progress
+				stallstep = self.step_count
+				stallvisits = list(self.visit_count_list)
+				numstall = 0
+				return
+			
+			numstall += 1
+			
+			if numstall >= window:
+				assert False, self.get_watchdog_report("No progress from {}, stuck at {}".format(progressfunc.__name__, progress), stallstep, stallvisits)
+		
+		self.add_periodic_task(sampleevery, watchdog_task)
+		self.watchdog_task = watchdog_task
+	
+	def disable_watchdog(self):
+		self.remove_periodic_task(self.watchdog_task)
+	
+	def get_watchdog_report(self, reason, stallstep, stallvisits, maxstates=5):
+		
+		# The states visited most since progress was last seen are where the machine is spinning
+		deltalist = [(self.visit_count_list[sidx] - stallvisits[sidx], sidx) for sidx in range(len(self.state_list))]
+		deltalist = sorted([dl for dl in deltalist if dl[0] > 0], reverse=True)[:maxstates]
+		
+		lines = ["Watchdog: {} at step {}, in state {}".format(reason, self.step_count, self.get_state())]
+		lines.append("Busiest states since step {}:".format(stallstep))
+		
+		for delta, sidx in deltalist:
+			lines.append("\t{} visits to {}".format(delta, self.state_list[sidx].__name__))
+		
+		return "\n".join(lines)
+	
+	def enable_fusion(self, minvisits=0):
+		
+		# Run each cycle of the transition graph that has at least minvisits visits so far
+		# as one generated loop, see machine_codegen. The fused loops skip all per-step checks,
+		# so they are only used while the check level is off and no profiler, history or trace is attached,
+		# and not when running to a target state
+		assert self.check_level == "off", "Fused execution requires check level off, have {}".format(self.check_level)
+		
+		self.fused_table = [None] * len(self.state_list)
+		fusedlist = []
+		
+		for members in find_cyclic_components(self.dispatch_next):
+			
+			if sum([self.visit_count_list[sid] for sid in members]) < minvisits:
+				continue
+			
+			fusedloop = build_fused_loop(self, members)
+			
+			for sid in members:
+				self.fused_table[sid] = fusedloop
+				
+			fusedlist.append([get_acro_name(self.state_list[sid]) for sid in members])
+			
+		return fusedlist
+	
+	def disable_fusion(self):
+		self.fused_table = None
+	
+	def enable_cycle_detection(self, syncstate, fingerprintfunc, skipfunc=None, maxlog=DEFAULT_CYCLE_LOG_SIZE):
+		
+		# On each visit to syncstate, usually the head of the main loop, log fingerprintfunc(),
+		# a hashable summary of the machine data. A repeated fingerprint means the machine has been
+		# going round a cycle since it was logged, so run2_step_count and run2_completion skip over
+		# whole cycles, just adding to the step and visit counts.
+		# Data left out of the fingerprint, e.g. a minute counter, keeps its value over the skip;
+		# give skipfunc(period_syncs, maxcycles) to advance it, it returns the number of cycles to skip
+		# Checkpoints and forks keep the setup. Pass methods of the machine, so the copy calls its own
+		self.cycle_sync_id = self.state_id_map[self.lookup_state_name(syncstate)]
+		self.cycle_fingerprint = fingerprintfunc
+		self.cycle_skip_func = skipfunc
+		self.cycle_log_size = maxlog
+		self.cycle_log = {}
+		self.cycle_info = None
+	
+	def get_callable_ref(self, func):
+		
+		# Methods of this machine go by name, so a restored or forked machine calls its own
+		if getattr(func, "__self__", None) is self:
+			return func.__name__
+		return func
+	
+	def get_callable(self, funcref):
+		return getattr(self, funcref) if type(funcref) is str else funcref
+	
+	def get_cycle_setup(self):
+		
+		if self.cycle_sync_id is None:
+			return None
+		
+		return {
+			"sync_state" : self.state_list[self.cycle_sync_id].__name__,
+			"fingerprint" : self.get_callable_ref(self.cycle_fingerprint),
+			"skip_func" : self.get_callable_ref(self.cycle_skip_func),
+			"log_size" : self.cycle_log_size,
+			"log" : self.cycle_log,
+			"info" : self.cycle_info,
+			"start_visits" : self.cycle_start_visits
+		}
+	
+	def restore_cycle_setup(self, setup):
+		
+		if setup is None:
+			self.disable_cycle_detection()
+			return
+		
+		self.cycle_sync_id = self.state_id_map[getattr(self, setup["sync_state"])]
+		self.cycle_fingerprint = self.get_callable(setup["fingerprint"])
+		self.cycle_skip_func = self.get_callable(setup["skip_func"])
+		self.cycle_log_size = setup["log_size"]
+		self.cycle_log = dict(setup["log"])
+		self.cycle_info = setup["info"]
+		self.cycle_start_visits = setup["start_visits"]
+	
+	def disable_cycle_detection(self):
+		self.cycle_sync_id = None
+		self.cycle_log = {}
+	
+	def log_cycle_fingerprint(self):
+		
+		fprint = self.cycle_fingerprint()
+		logged = self.cycle_log.get(fprint)
+		
+		if logged is None:
+			# Clearing rather than evicting keeps this cheap, a cycle shorter than the log is still found after
+			if len(self.cycle_log) >= self.cycle_log_size:
+				self.cycle_log.clear()
+			self.cycle_log[fprint] = (self.step_count, list(self.visit_count_list))
+			return None
+		
+		startstep, startvisits = logged
+		syncid = self.cycle_sync_id
+		
+		self.cycle_info = CycleInfo(startstep, self.step_count - startstep, self.visit_count_list[syncid] - startvisits[syncid])
+		self.cycle_start_visits = startvisits
+		self.cycle_log = {}
+		return self.cycle_info
+	
+	def skip_cycles(self, stopstep=None):
+		
+		info = self.cycle_info
+		maxcycles = sys.maxsize if stopstep is None else (stopstep - self.step_count) // info.period_steps
+		
+		if self.cycle_skip_func is not None:
+			numcycle = self.cycle_skip_func(info.period_syncs, maxcycles)
+		else:
+			assert stopstep is not None, "Machine repeats the configuration from step {} every {} steps, it will never complete".format(info.start_step, info.period_steps)
+			numcycle = maxcycles
+		
+		assert 0 <= numcycle <= maxcycles, "Cannot skip {} cycles, at most {}".format(numcycle, maxcycles)
+		
+		self.step_count += numcycle * info.period_steps
+		
+		for sidx, startvisit in enumerate(self.cycle_start_visits):
+			self.visit_count_list[sidx] += numcycle * (self.visit_count_list[sidx] - startvisit)
+		
+		self.reschedule_periodic_tasks()
+		return numcycle
+	
+	def run_cycle_checked(self, stopstep=None):
+		
+		# Compiled run that stops at each visit to the sync state to log its fingerprint,
+		# until a cycle is found and skipped; after that it runs on as normal
+		syncid = self.cycle_sync_id
+		stopatend = stopstep is None
+		
+		while self.cycle_info is None and self.step_count != stopstep:
+			
+			self.run_compiled(stopstep=stopstep, stopatend=stopatend, targetid=syncid)
+			
+			if self.step_count == stopstep or self.get_state_type(self.cur_state_func) == "end":
+				return
+			
+			if self.log_cycle_fingerprint() is not None:
+				self.skip_cycles(stopstep)
+				break
+			
+			self.run_compiled(stopstep=self.step_count+1)
+		
+		self.run_compiled(stopstep=stopstep, stopatend=stopatend)
+	
+	def set_check_level(self, level, sampleevery=DEFAULT_CHECK_SAMPLE):
+		
+		assert level in CHECK_LEVEL_LIST, "Unknown check level {}, options are {}".format(level, CHECK_LEVEL_LIST)
+		assert sampleevery >= 1, "Sample interval must be positive, got {}".format(sampleevery)
+		
+		self.check_level = level
+		
+		# The run loop counts down to the next checked step.
+		# With checks off, the countdown starts at zero and never comes back to it
+		self.check_interval = { "full" : 1, "sampled" : sampleevery, "off" : 0 }.get(level)
+		self.check_countdown = self.check_interval
+
 	def run_until(self, conditfunc):
 
+		if self.compiled_mode:
+			self.run_compiled(conditfunc=conditfunc)
+			return
+
 		while True:
 			if conditfunc(self):
 				break
@@ -235,25 +931,40 @@ class FiniteStateMachine:
 
 	def run_one_step(self):
 		
+		if self.compiled_mode:
+			self.run_compiled(stopstep=self.step_count+1)
+			return
+		
+		if self.step_count == self.next_task_step:
+			self.run_periodic_tasks()
+		
 		statetype = self.get_state_type(self.cur_state_func)
 		
 		# Log the state visit
-		self.state_visit_count[self.cur_state_func] += 1
+		self.visit_count_list[self.state_id_map[self.cur_state_func]] += 1
+		
+		assert statetype != "end", "Attempt to run end state {}, should check for complete before calling".format(self.cur_state_func.__name__)
 		
-		for (sfunc, maxvisit) in self.max_visit_map.items():
-			assert self.state_visit_count[sfunc] <= maxvisit, "Visited state {} too many times".format(get_basic_name(sfunc))		
+		self.check_countdown -= 1
+		docheck = self.check_countdown == 0
 		
-		assert statetype is not "end", "Attempt to run end state {}, should check for complete before calling".format(self.cur_state_func.__name__)
+		if docheck:
+			self.check_countdown = self.check_interval
+			self.check_visit_limit(self.state_id_map[self.cur_state_func])
 		
-		myreturn = self.cur_state_func()
+		if self.wrapped_func is None:
+			myreturn = self.cur_state_func()
+		else:
+			myreturn = self.wrapped_func[self.state_id_map[self.cur_state_func]]()
 		
 		#print("Ran curstate {}, statetype is {}, return value is {}".format(curbasic, statetype, myreturn))
+		
+		if docheck:
+			self.check_return_contract(self.cur_state_func, myreturn)
 				
 		if statetype == "op":
-			assert myreturn == None, "Got return value of {} in op state {}, op state should return None".format(myreturn, self.cur_state_func.__name__)
 			nextstate = self.transition_map[self.cur_state_func]
 		else:
-			assert myreturn in [True, False], "Got return value of {} in query state {}, query state should return True/False".format(myreturn, self.cur_state_func.__name__)
 			nextstate = self.transition_map[self.cur_state_func][myreturn]
 		
 		#print("\t {} --> {}".format(curbasic, get_basic_name(nextstate)))
@@ -263,21 +974,207 @@ class FiniteStateMachine:
 		self.step_count += 1
 
 
+	def check_visit_limit(self, stateid):
+		
+		assert self.visit_count_list[stateid] <= self.visit_limit_list[stateid], "Visited state {} too many times".format(get_basic_name(self.state_list[stateid]))
+	
+	def check_visit_limits(self):
+		
+		for stateid in range(len(self.state_list)):
+			self.check_visit_limit(stateid)
+	
+	def check_return_contract(self, statefunc, myreturn):
+		
+		if self.get_state_type(statefunc) == "op":
+			assert myreturn == None, "Got return value of {} in op state {}, op state should return None".format(myreturn, statefunc.__name__)
+		else:
+			assert myreturn in [True, False], "Got return value of {} in query state {}, query state should return True/False".format(myreturn, statefunc.__name__)
+	
+
+	def run_compiled(self, stopstep=None, stopatend=False, conditfunc=None, targetid=None):
+		
+		if self.fused_table is not None and self.check_interval == 0 and self.wrapped_func is None and conditfunc is None and targetid is None:
+			self.run_fused(stopstep=stopstep, stopatend=stopatend)
+			return
+		
+		# Bind everything the loop touches to locals, the loop itself
+		# only does list lookups on integer state IDs
+		functable = self.dispatch_func if self.wrapped_func is None else self.wrapped_func
+		nexttable = self.dispatch_next
+		statelist = self.state_list
+		visits = self.visit_count_list
+		limits = self.visit_limit_list
+		checklimit = self.check_visit_limit
+		checkcontract = self.check_return_contract
+		checkinterval = self.check_interval
+		
+		stateid = self.state_id_map[self.cur_state_func]
+		stepcount = self.step_count
+		checkdown = self.check_countdown
+		nexttask = self.next_task_step
+		
+		try:
+			while stepcount != stopstep:
+				
+				if stateid == targetid:
+					break
+				
+				statefunc = functable[stateid]
+				
+				if conditfunc is not None:
+					self.cur_state_func = statelist[stateid]
+					if conditfunc(self):
+						break
+				
+				if statefunc is None:
+					if stopatend:
+						break
+					assert False, "Attempt to run end state {}, should check for complete before calling".format(statelist[stateid].__name__)
+				
+				if stepcount == nexttask:
+					self.cur_state_func = statelist[stateid]
+					self.check_countdown = checkdown
+					nexttask = self.run_periodic_tasks()
+				
+				visits[stateid] += 1
+				
+				checkdown -= 1
+				if checkdown:
+					myreturn = statefunc()
+				else:
+					checkdown = checkinterval
+					if visits[stateid] > limits[stateid]:
+						checklimit(stateid)
+					myreturn = statefunc()
+					isop = type(nexttable[stateid]) is int
+					if (myreturn is not None) if isop else (myreturn not in (True, False)):
+						checkcontract(statelist[stateid], myreturn)
+				
+				# Op states return None and go to a single successor,
+				# query states index their (false, true) successor pair
+				nextinfo = nexttable[stateid]
+				stateid = nextinfo if myreturn is None else nextinfo[myreturn]
+				
+				stepcount += 1
+				self.step_count = stepcount
+				
+		finally:
+			self.cur_state_func = statelist[stateid]
+			self.check_countdown = checkdown
+
+	def run_fused(self, stopstep=None, stopatend=False):
+		
+		# Same as run_compiled with checks off, except that on entering a fused cycle
+		# the generated loop runs until the machine leaves it
+		functable = self.dispatch_func
+		nexttable = self.dispatch_next
+		fusedtable = self.fused_table
+		statelist = self.state_list
+		visits = self.visit_count_list
+		
+		stateid = self.state_id_map[self.cur_state_func]
+		stepcount = self.step_count
+		nexttask = self.next_task_step
+		
+		try:
+			while stepcount != stopstep:
+				
+				if stepcount == nexttask and functable[stateid] is not None:
+					self.cur_state_func = statelist[stateid]
+					nexttask = self.run_periodic_tasks()
+				
+				fusedloop = fusedtable[stateid]
+				
+				if fusedloop is not None:
+					# The fused loop has to come back out for the next periodic task
+					fusedstop = stopstep
+					if nexttask != NO_TASK_STEP and (stopstep is None or nexttask < stopstep):
+						fusedstop = nexttask
+					try:
+						stateid, stepcount = fusedloop(stateid, stepcount, fusedstop)
+					except BaseException:
+						stateid = self.fused_abort_state
+						raise
+					continue
+				
+				statefunc = functable[stateid]
+				
+				if statefunc is None:
+					if stopatend:
+						break
+					assert False, "Attempt to run end state {}, should check for complete before calling".format(statelist[stateid].__name__)
+				
+				visits[stateid] += 1
+				myreturn = statefunc()
+				
+				nextinfo = nexttable[stateid]
+				stateid = nextinfo if myreturn is None else nextinfo[myreturn]
+				
+				stepcount += 1
+				self.step_count = stepcount
+				
+		finally:
+			self.cur_state_func = statelist[stateid]
+
+	def run_n_steps(self, maxsteps, targetcode=None):
+		
+		# Batched run: stop after maxsteps, on arriving at the target state, or at an end state
+		alpha = time.time()
+		startstep = self.step_count
+		targetfunc = None if targetcode is None else self.lookup_state_name(targetcode)
+		stopstep = None if maxsteps is None else startstep + maxsteps
+		
+		if self.compiled_mode:
+			targetid = None if targetfunc is None else self.state_id_map[targetfunc]
+			self.run_compiled(stopstep=stopstep, stopatend=True, targetid=targetid)
+		else:
+			while self.step_count != stopstep and self.cur_state_func != targetfunc and self.get_state_type(self.cur_state_func) != "end":
+				self.run_one_step()
+			
+		return RunSummary(self.step_count - startstep, self.get_state(), time.time() - alpha)
+	
+	def run_until_state(self, statecode, maxsteps=None):
+		return self.run_n_steps(maxsteps, targetcode=statecode)
+
 	def run2_step_count(self, stepnum):
+		
+		if stepnum < self.step_count:
+			self.restore_snapshot(stepnum)
+		
+		if self.cycle_sync_id is not None:
+			self.run_cycle_checked(stopstep=stepnum)
+			return
+		
+		if self.compiled_mode:
+			self.run_compiled(stopstep=stepnum)
+			return
+		
 		while self.step_count != stepnum:			
 			self.run_one_step()
 
 	
 	def run2_completion(self):
+		
+		if self.cycle_sync_id is not None:
+			self.run_cycle_checked()
+		
+		if self.compiled_mode:
+			self.run_compiled(stopatend=True)
+		
 		while self.get_state_type(self.cur_state_func) != "end":
 			self.run_one_step()
-			
+		
+		if self.check_level != "full":
+			self.check_visit_limits()
+		
+		visitmap = self.state_visit_count
+		
 		for (sfunc, expvisit) in self.exact_visit_map.items():
-			assert self.state_visit_count[sfunc] == self.exact_visit_map[sfunc], (
-				"Visited state {} {} times, but expected {}".format(get_basic_name(sfunc), self.state_visit_count[sfunc], expvisit))
+			assert visitmap[sfunc] == self.exact_visit_map[sfunc], (
+				"Visited state {} {} times, but expected {}".format(get_basic_name(sfunc), visitmap[sfunc], expvisit))
 			
 			
-	def get_gv_tool(self, graphlabel="FsMachine"):
+	def get_gv_tool(self, graphlabel="FsMachine", profiler=None):
 		
 		gvtool = GraphVizTool()
 		gvtool.set_property("graphlabel", graphlabel)
@@ -303,7 +1200,47 @@ class FiniteStateMachine:
 			for (istrue, nextstate) in self.transition_map[statefunc].items():
 				labelstr = str(istrue)[0]
 				gvtool.add_edge(get_camel_name(statefunc), get_camel_name(nextstate), label=labelstr)
+		
+		if profiler is not None:
+			self.add_heat_info(gvtool, profiler)
 	
 		return gvtool
+	
+	def add_heat_info(self, gvtool, profiler):
+		
+		# Node fill shows the share of self time, edge width how often the edge was taken
+		statestats = profiler.get_state_stats(self)
+		edgecounts = profiler.get_edge_counts(self)
+		
+		totalself = sum([selftime for (_, _, selftime) in statestats.values()])
+		maxself = max([selftime for (_, _, selftime) in statestats.values()] + [0])
+		maxcount = max(list(edgecounts.values()) + [0])
+		
+		for statefunc in self.state_list:
+			
+			nodecode = get_camel_name(statefunc)
+			calls, _, selftime = statestats.get(statefunc.__name__, (0, 0.0, 0.0))
+			
+			if self.get_state_type(statefunc) == "end":
+				continue
+			
+			selfpct = 100.0 * selftime / totalself if totalself > 0 else 0.0
+			heat = selftime / maxself if maxself > 0 else 0.0
+			
+			gvtool.set_node_attr(nodecode, "style", "filled")
+			gvtool.set_node_attr(nodecode, "fillcolor", "0.000 {:.3f} 1.000".format(heat))
+			gvtool.set_node_attr(nodecode, "label", "{}\\n{} calls, {:.1f}%".format(nodecode, calls, selfpct))
+		
+		for ((srcname, dstname), count) in edgecounts.items():
+			
+			srcnode = get_camel_name(getattr(self, srcname))
+			dstnode = get_camel_name(getattr(self, dstname))
+			
+			# Log scale, edge counts in a hot loop run to the millions
+			penwidth = 1.0 + 5.0 * math.log(1 + count) / math.log(1 + maxcount)
+			gvtool.set_edge_attr(srcnode, dstnode, "penwidth", "{:.2f}".format(penwidth))
+			
+			labelstr = gvtool.edge_label_map.get((srcnode, dstnode), "")
+			gvtool.set_edge_attr(srcnode, dstnode, "label", "{} {}".format(labelstr, count).strip())
 
 
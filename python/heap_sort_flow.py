@@ -53,7 +53,7 @@ class HeapSortMachine(FiniteStateMachine):
 		self.set_max_allowed_visit("CPHK", math.ceil(len(olist)*math.log(len(olist),2)))
 	
 	def get_parent_position(self):
-		return (self.cursor_position-1)/2
+		return (self.cursor_position-1)//2
 		
 	def get_left_kid_pos(self):
 		return 2*self.cursor_position+1
@@ -155,7 +155,7 @@ if __name__ == "__main__":
 		quit()
 		
 		
-	mylist = range(10000)
+	mylist = list(range(10000))
 	random.shuffle(mylist)
 	
 	hsmachine = HeapSortMachine(mylist)
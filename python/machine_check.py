@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+from collections import deque
+
+def get_successors(nextinfo):
+	if nextinfo is None:
+		return []
+	if type(nextinfo) is int:
+		return [nextinfo]
+	return list(nextinfo)
+
+def find_reachable(startids, edgelists):
+
+	# Breadth first over adjacency lists of state IDs, each state and edge is seen once
+	seen = set(startids)
+	queue = deque(startids)
+
+	while queue:
+		for nextid in edgelists[queue.popleft()]:
+			if nextid not in seen:
+				seen.add(nextid)
+				queue.append(nextid)
+
+	return seen
+
+def check_dispatch_table(statenames, dispatch_next):
+
+	# Static checks on a machine's successor table, linear in states plus transitions.
+	# Returns a list of problem strings, empty for a well-wired machine:
+	# no end state at all, states the initial state can't reach,
+	# and reachable states from which no end state can be reached, where a run would loop forever
+	problems = []
+	numstate = len(dispatch_next)
+
+	forward = [get_successors(nextinfo) for nextinfo in dispatch_next]
+	backward = [[] for _ in range(numstate)]
+
+	for sid, succlist in enumerate(forward):
+		for nextid in succlist:
+			backward[nextid].append(sid)
+
+	endids = [sid for sid in range(numstate) if dispatch_next[sid] is None]
+
+	if not endids:
+		problems.append("No end state, name one ending in _complete or _end")
+
+	reachable = find_reachable([0], forward) if numstate > 0 else set()
+	canfinish = find_reachable(endids, backward)
+
+	for sid in range(numstate):
+		if sid not in reachable:
+			problems.append("State {} is unreachable from the initial state".format(statenames[sid]))
+		elif sid not in canfinish:
+			problems.append("State {} can never reach an end state".format(statenames[sid]))
+
+	return problems
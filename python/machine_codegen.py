@@ -0,0 +1,247 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+def find_cyclic_components(dispatch_next):
+
+	# Tarjan's strongly connected components over the state ID successor table,
+	# iterative so large machines don't hit the recursion limit.
+	# Returns only the components that contain a cycle, each as a sorted list of IDs
+
+	def successors(stateid):
+		nextinfo = dispatch_next[stateid]
+		if nextinfo is None:
+			return []
+		if type(nextinfo) is int:
+			return [nextinfo]
+		return sorted(set(nextinfo))
+
+	index_map = {}
+	lowlink_map = {}
+	onstack = set()
+	stack = []
+	components = []
+	counter = 0
+
+	for rootid in range(len(dispatch_next)):
+
+		if rootid in index_map:
+			continue
+
+		worklist = [(rootid, iter(successors(rootid)))]
+		index_map[rootid] = lowlink_map[rootid] = counter
+		counter += 1
+		stack.append(rootid)
+		onstack.add(rootid)
+
+		while worklist:
+
+			stateid, succiter = worklist[-1]
+			nextid = next(succiter, None)
+
+			if nextid is not None:
+				if nextid not in index_map:
+					index_map[nextid] = lowlink_map[nextid] = counter
+					counter += 1
+					stack.append(nextid)
+					onstack.add(nextid)
+					worklist.append((nextid, iter(successors(nextid))))
+				elif nextid in onstack:
+					lowlink_map[stateid] = min(lowlink_map[stateid], index_map[nextid])
+				continue
+
+			worklist.pop()
+
+			if worklist:
+				parentid = worklist[-1][0]
+				lowlink_map[parentid] = min(lowlink_map[parentid], lowlink_map[stateid])
+
+			if lowlink_map[stateid] != index_map[stateid]:
+				continue
+
+			members = []
+			while True:
+				popid = stack.pop()
+				onstack.discard(popid)
+				members.append(popid)
+				if popid == stateid:
+					break
+
+			if len(members) > 1 or stateid in successors(stateid):
+				components.append(sorted(members))
+
+	return components
+
+
+def generate_dispatch_lines(fsmachine, members, visitorder, indent):
+
+	# The dispatch loop over integer state shared by fused loops and generated modules.
+	# It is an if/elif chain in visitorder (hottest first), where each branch runs its state
+	# and then carries on straight through any op successors, up to and including the next query,
+	# so dispatch only happens at branch points. State sid is called as f<sid> and counted in v<sid>.
+	# The loop exits on reaching stopstep or on leaving the members
+	memberset = set(members)
+
+	srclist = []
+	srclist.append("while True:")
+
+	for idx, headid in enumerate(visitorder):
+
+		keyword = "if" if idx == 0 else "elif"
+		srclist.append("    {} stateid == {}:".format(keyword, headid))
+
+		chainset = set()
+		sid = headid
+
+		while True:
+
+			nextinfo = fsmachine.dispatch_next[sid]
+			chainset.add(sid)
+
+			srclist.append("        # {}".format(fsmachine.state_list[sid].__name__))
+			srclist.append("        v{} += 1".format(sid))
+
+			if type(nextinfo) is not int:
+				srclist.append("        stateid = {} if f{}() else {}".format(nextinfo[True], sid, nextinfo[False]))
+				srclist.append("        stepcount += 1")
+				srclist.append("        machine.step_count = stepcount")
+				break
+
+			srclist.append("        f{}()".format(sid))
+			srclist.append("        stepcount += 1")
+			srclist.append("        machine.step_count = stepcount")
+			srclist.append("        stateid = {}".format(nextinfo))
+
+			if nextinfo not in memberset or nextinfo in chainset:
+				break
+
+			srclist.append("        if stepcount == stopstep:")
+			srclist.append("            break")
+			sid = nextinfo
+
+	srclist.append("    if stepcount == stopstep or stateid not in members:")
+	srclist.append("        break")
+
+	return [indent + line for line in srclist]
+
+
+def generate_fused_source(fsmachine, members, visitorder):
+
+	# Source for a factory that returns the fused loop for one component.
+	# Bound methods are called directly, and visit counts stay in locals until the loop exits
+	srclist = []
+	srclist.append("def make_fused_loop(machine, visits, members, {}):".format(", ".join(["f{}".format(sid) for sid in members])))
+	srclist.append("")
+	srclist.append("    def fused_loop(stateid, stepcount, stopstep):")
+	srclist.append("")
+
+	for sid in members:
+		srclist.append("        v{} = 0".format(sid))
+
+	srclist.append("")
+	srclist.append("        try:")
+	srclist.extend(generate_dispatch_lines(fsmachine, members, visitorder, " " * 12))
+	srclist.append("        except BaseException:")
+	srclist.append("            machine.fused_abort_state = stateid")
+	srclist.append("            raise")
+	srclist.append("        finally:")
+
+	for sid in members:
+		srclist.append("            visits[{}] += v{}".format(sid, sid))
+
+	srclist.append("")
+	srclist.append("        return stateid, stepcount")
+	srclist.append("")
+	srclist.append("    return fused_loop")
+
+	return "\n".join(srclist) + "\n"
+
+
+def build_fused_loop(fsmachine, members):
+
+	# Hottest states first in the dispatch chain, by the visit counts so far
+	visitorder = sorted(members, key=lambda sid: (-fsmachine.visit_count_list[sid], sid))
+
+	fusedsrc = generate_fused_source(fsmachine, members, visitorder)
+
+	namespace = {}
+	exec(compile(fusedsrc, "<fused {}>".format(type(fsmachine).__name__), "exec"), namespace)
+
+	funclist = [fsmachine.dispatch_func[sid] for sid in members]
+	return namespace["make_fused_loop"](fsmachine, fsmachine.visit_count_list, frozenset(members), *funclist)
+
+
+def generate_machine_module(fsmachine):
+
+	# Source for a standalone module with a single run(machine, stopstep=None) function,
+	# which runs the whole machine as one generated loop until it reaches an end state or stopstep.
+	# It skips all per-step checks, use the regular engine for debugging
+	machlabel = "{}.{}".format(type(fsmachine).__module__, type(fsmachine).__name__)
+	statenames = [sfunc.__name__ for sfunc in fsmachine.state_list]
+	members = [sid for sid, sfunc in enumerate(fsmachine.dispatch_func) if sfunc is not None]
+	visitorder = sorted(members, key=lambda sid: (-fsmachine.visit_count_list[sid], sid))
+
+	srclist = []
+	srclist.append("# Generated by machine_codegen from {}, do not edit".format(machlabel))
+	srclist.append("")
+	srclist.append("STATE_NAMES = [")
+
+	for sname in statenames:
+		srclist.append("    \"{}\",".format(sname))
+
+	srclist.append("]")
+	srclist.append("")
+	srclist.append("DISPATCH_NEXT = {}".format(repr(fsmachine.dispatch_next)))
+	srclist.append("")
+	srclist.append("")
+	srclist.append("def run(machine, stopstep=None):")
+	srclist.append("")
+	srclist.append("    assert [sfunc.__name__ for sfunc in machine.state_list] == STATE_NAMES, \"Machine states changed, regenerate this module\"")
+	srclist.append("    assert machine.dispatch_next == DISPATCH_NEXT, \"Machine transitions changed, regenerate this module\"")
+	srclist.append("")
+
+	for sid in members:
+		srclist.append("    f{} = machine.{}".format(sid, statenames[sid]))
+
+	srclist.append("")
+	srclist.append("    members = frozenset({})".format(repr(members)))
+	srclist.append("    visits = machine.visit_count_list")
+	srclist.append("")
+
+	for sid in members:
+		srclist.append("    v{} = 0".format(sid))
+
+	srclist.append("")
+	srclist.append("    stateid = STATE_NAMES.index(machine.get_state())")
+	srclist.append("    stepcount = machine.step_count")
+	srclist.append("")
+	srclist.append("    if stateid not in members or stepcount == stopstep:")
+	srclist.append("        return machine")
+	srclist.append("")
+	srclist.append("    try:")
+	srclist.extend(generate_dispatch_lines(fsmachine, members, visitorder, " " * 8))
+	srclist.append("    finally:")
+
+	for sid in members:
+		srclist.append("        visits[{}] += v{}".format(sid, sid))
+
+	srclist.append("        machine.cur_state_func = getattr(machine, STATE_NAMES[stateid])")
+	srclist.append("")
+	srclist.append("    return machine")
+
+	return "\n".join(srclist) + "\n"
+
+
+def write_machine_module(fsmachine, outpath):
+
+	with open(outpath, 'w') as fh:
+		fh.write(generate_machine_module(fsmachine))
+
+
+def build_machine_runner(fsmachine):
+
+	# The generated run function, compiled in memory instead of written out
+	namespace = {}
+	machsrc = generate_machine_module(fsmachine)
+	exec(compile(machsrc, "<generated {}>".format(type(fsmachine).__name__), "exec"), namespace)
+	return namespace["run"]
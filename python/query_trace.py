@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import pickle
+from array import array
+
+# Queries between state ID checkpoints in a trace
+DEFAULT_TRACE_CHECKPOINT = 4096
+
+class QueryTrace:
+
+	# Only query states branch, so a run is determined by its starting position and the sequence
+	# of query results. The results are packed 8 to a byte, and every checkpoint_every queries
+	# the trace notes the step and state ID of that query, so a position can be found without
+	# walking from the start. Op states are not wrapped, so they run at full speed while tracing
+
+	def __init__(self, startstep, startid, checkpointevery=DEFAULT_TRACE_CHECKPOINT):
+
+		assert checkpointevery >= 1, "Checkpoint interval must be positive, got {}".format(checkpointevery)
+
+		self.start_step = startstep
+		self.start_id = startid
+		self.checkpoint_every = checkpointevery
+
+		self.bits = bytearray()
+		self.num_query = 0
+
+		# One entry per checkpoint: step of the query, its state ID, and its query index
+		self.check_step = array('q')
+		self.check_state = array('i')
+		self.check_query = array('q')
+
+	def wrap_state(self, fsmachine, stateid, statefunc):
+
+		if type(fsmachine.dispatch_next[stateid]) is int:
+			return statefunc
+
+		def traced():
+			myreturn = statefunc()
+			self.record(fsmachine.step_count, stateid, myreturn)
+			return myreturn
+
+		return traced
+
+	def record(self, stepcount, stateid, myreturn):
+
+		qidx = self.num_query
+
+		if qidx & 7 == 0:
+			self.bits.append(0)
+
+		if myreturn:
+			self.bits[-1] |= 1 << (qidx & 7)
+
+		if qidx % self.checkpoint_every == 0:
+			self.check_step.append(stepcount)
+			self.check_state.append(stateid)
+			self.check_query.append(qidx)
+
+		self.num_query = qidx + 1
+
+	def get_result(self, qidx):
+		return (self.bits[qidx >> 3] >> (qidx & 7)) & 1 == 1
+
+	def iter_steps(self, dispatch_next, startcheck=0):
+
+		# Replays the run's control flow from the transition table alone, without running any states.
+		# Yields (step, state ID, result) for every step, result is None for ops; starts from the
+		# given checkpoint, and stops at an end state or at the first query past the end of the trace
+		if startcheck == 0:
+			stepcount, stateid, qidx = self.start_step, self.start_id, 0
+		else:
+			stepcount, stateid, qidx = self.check_step[startcheck], self.check_state[startcheck], self.check_query[startcheck]
+
+		while True:
+
+			nextinfo = dispatch_next[stateid]
+
+			if nextinfo is None:
+				return
+
+			if type(nextinfo) is int:
+				yield stepcount, stateid, None
+				stateid = nextinfo
+			else:
+				if qidx >= self.num_query:
+					return
+				result = self.get_result(qidx)
+				yield stepcount, stateid, result
+				stateid = nextinfo[result]
+				qidx += 1
+
+			stepcount += 1
+
+	def find_query_step(self, dispatch_next, qidx):
+
+		# Step and state ID of the query with index qidx, walking from the checkpoint before it
+		startcheck = qidx // self.checkpoint_every
+		curidx = self.check_query[startcheck] if startcheck > 0 else 0
+
+		for stepcount, stateid, result in self.iter_steps(dispatch_next, startcheck):
+			if result is None:
+				continue
+			if curidx == qidx:
+				return stepcount, stateid
+			curidx += 1
+
+		assert False, "Query index {} is past the end of the trace".format(qidx)
+
+	def write(self, outpath):
+
+		with open(outpath, 'wb') as fh:
+			pickle.dump(self, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_trace(inpath):
+
+	with open(inpath, 'rb') as fh:
+		return pickle.load(fh)
+
+
+def find_divergence(tracea, traceb, dispatch_next):
+
+	# First query where two traces of the same machine from the same start disagree,
+	# as (step, state ID, result in a, result in b), where a result is None if that trace ends first.
+	# Returns None if the traces agree all the way
+	assert (tracea.start_step, tracea.start_id) == (traceb.start_step, traceb.start_id), "Traces start at different positions"
+
+	numcommon = min(tracea.num_query, traceb.num_query)
+	numbyte = numcommon >> 3
+
+	# The whole bytes are compared as one slice, and only if they differ is the first differing byte looked for.
+	# The scan bit by bit then starts at that byte, or at the trailing partial byte if the whole bytes agree
+	qidx = numbyte << 3
+	if tracea.bits[:numbyte] != traceb.bits[:numbyte]:
+		byteidx = next(bidx for bidx in range(numbyte) if tracea.bits[bidx] != traceb.bits[bidx])
+		qidx = byteidx << 3
+
+	while qidx < numcommon and tracea.get_result(qidx) == traceb.get_result(qidx):
+		qidx += 1
+
+	if qidx == tracea.num_query and qidx == traceb.num_query:
+		return None
+
+	stepcount, stateid = (tracea if qidx < tracea.num_query else traceb).find_query_step(dispatch_next, qidx)
+	resulta = tracea.get_result(qidx) if qidx < tracea.num_query else None
+	resultb = traceb.get_result(qidx) if qidx < traceb.num_query else None
+	return stepcount, stateid, resulta, resultb
+
+
+def run_tests():
+	
+	# The traces don't need a real machine: a single query state that loops back to itself
+	dispatch_next = [(0, 0)]
+	
+	def build_trace(results):
+		trace = QueryTrace(0, 0, checkpointevery=4)
+		for stepcount, myreturn in enumerate(results):
+			trace.record(stepcount, 0, myreturn)
+		return trace
+	
+	base = [bool(qidx % 3 == 0) for qidx in range(20)]
+	
+	def flipped(qidx, numquery=20):
+		results = list(base[:numquery])
+		results[qidx] = not results[qidx]
+		return results
+	
+	assert find_divergence(build_trace(base), build_trace(base), dispatch_next) is None
+	
+	# In the trailing partial byte, in a full byte, and in the first query
+	for qidx in [9, 19, 5, 0]:
+		found = find_divergence(build_trace(base[:10] if qidx == 9 else base), build_trace(flipped(qidx, 10 if qidx == 9 else 20)), dispatch_next)
+		assert found == (qidx, 0, base[qidx], not base[qidx]), "Expected divergence at query {}, got {}".format(qidx, found)
+	
+	# One trace stops early, in either order
+	assert find_divergence(build_trace(base[:13]), build_trace(base), dispatch_next) == (13, 0, None, base[13])
+	assert find_divergence(build_trace(base), build_trace(base[:13]), dispatch_next) == (13, 0, base[13], None)
+	
+	# Query positions come back through the checkpoints
+	trace = build_trace(base)
+	for qidx in range(20):
+		assert trace.find_query_step(dispatch_next, qidx) == (qidx, 0)
+	
+	print("Query trace tests successful")
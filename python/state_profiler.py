@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import time
+from collections import Counter
+
+def get_machine_label(fsmachine):
+	# Advent machines are all called PMachine, so the module is part of the label
+	return "{}.{}".format(type(fsmachine).__module__, type(fsmachine).__name__)
+
+class StateProfiler:
+
+	# Records per-state call counts, cumulative and self wall time, and per-edge
+	# transition counts. One profiler can be shared by a machine and its sub-machines;
+	# time spent in states of a nested machine is then taken out of the parent state's self time
+
+	def __init__(self):
+
+		# Keyed by state label, module.Class.sNN_name
+		self.call_count = Counter()
+		self.cum_time = Counter()
+		self.self_time = Counter()
+
+		# Keyed by (from label, to label)
+		self.edge_count = Counter()
+
+		# Self time keyed by the semicolon-joined stack of state labels
+		self.stack_time = Counter()
+
+		# Currently running states, each is [label, time spent in nested states]
+		self.frame_stack = []
+
+	def wrap_state(self, fsmachine, stateid, statefunc):
+
+		nextinfo = fsmachine.dispatch_next[stateid]
+
+		machlabel = get_machine_label(fsmachine)
+		label = "{}.{}".format(machlabel, statefunc.__name__)
+
+		def nextlabel(nextid):
+			return "{}.{}".format(machlabel, fsmachine.state_list[nextid].__name__)
+
+		if type(nextinfo) is int:
+			edgemap = { None : (label, nextlabel(nextinfo)) }
+		else:
+			edgemap = { False : (label, nextlabel(nextinfo[False])), True : (label, nextlabel(nextinfo[True])) }
+
+		framestack = self.frame_stack
+		edgecount = self.edge_count
+
+		def profiled():
+
+			frame = [label, 0.0]
+			framestack.append(frame)
+			alpha = time.perf_counter()
+
+			try:
+				myreturn = statefunc()
+			finally:
+				elapsed = time.perf_counter() - alpha
+				framestack.pop()
+				self.record_call(frame, elapsed)
+
+			edgecount[edgemap.get(myreturn)] += 1
+			return myreturn
+
+		return profiled
+
+	def record_call(self, frame, elapsed):
+
+		label, nestedtime = frame
+
+		self.call_count[label] += 1
+		self.cum_time[label] += elapsed
+		self.self_time[label] += elapsed - nestedtime
+
+		stackkey = ";".join([f[0] for f in self.frame_stack] + [label])
+		self.stack_time[stackkey] += elapsed - nestedtime
+
+		if self.frame_stack:
+			self.frame_stack[-1][1] += elapsed
+
+	def get_state_stats(self, fsmachine):
+
+		# Map of state function name to (calls, cumulative secs, self secs) for one machine
+		prefix = get_machine_label(fsmachine) + "."
+
+		return { label[len(prefix):] : (self.call_count[label], self.cum_time[label], self.self_time[label])
+					for label in self.call_count if label.startswith(prefix) }
+
+	def get_edge_counts(self, fsmachine):
+
+		# Map of (from name, to name) to the number of times that transition was taken
+		prefix = get_machine_label(fsmachine) + "."
+
+		return { (src[len(prefix):], dst[len(prefix):]) : count
+					for (src, dst), count in self.edge_count.items() if src.startswith(prefix) }
+
+	def get_report_lines(self, maxlines=None):
+
+		totalself = sum(self.self_time.values())
+
+		yield "{:>10} {:>10} {:>10} {:>6}  {}".format("calls", "cum_secs", "self_secs", "self%", "state")
+
+		labellist = sorted(self.call_count, key=lambda lbl: -self.self_time[lbl])
+
+		for label in labellist[:maxlines]:
+			selfpct = 100.0 * self.self_time[label] / totalself if totalself > 0 else 0.0
+			yield "{:>10} {:>10.03f} {:>10.03f} {:>6.01f}  {}".format(self.call_count[label], self.cum_time[label], self.self_time[label], selfpct, label)
+
+		yield ""
+		yield "{:>10}  {}".format("count", "edge")
+
+		for (src, dst), count in self.edge_count.most_common(maxlines):
+			yield "{:>10}  {} -> {}".format(count, src, dst)
+
+	def get_collapsed_stack_lines(self):
+
+		# Flamegraph collapsed format, one "frame;frame;frame value" line per stack, value in microseconds
+		for stackkey, secs in sorted(self.stack_time.items()):
+			yield "{} {}".format(stackkey, int(round(secs * 1e6)))
+
+	def write_collapsed_stacks(self, outpath):
+
+		with open(outpath, 'w') as fh:
+			for oneline in self.get_collapsed_stack_lines():
+				fh.write(oneline + "\n")
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+from array import array
+
+# Query result codes in the history, op states record NO_RESULT
+NO_RESULT = -1
+
+DEFAULT_HISTORY_SIZE = 100000
+
+class VisitHistory:
+
+	# Fixed-size ring buffer of the most recent (step, state ID, query result) entries,
+	# held in flat arrays: 8 bytes for the step, 4 for the state ID and 1 for the result,
+	# so memory stays bounded however long the machine runs
+
+	def __init__(self, size=DEFAULT_HISTORY_SIZE):
+
+		assert size >= 1, "History size must be positive, got {}".format(size)
+
+		self.size = size
+		self.step_array = array('q', [0]) * size
+		self.state_array = array('i', [0]) * size
+		self.result_array = array('b', [0]) * size
+
+		# Slot for the next entry, and the number of entries ever recorded
+		self.next_pos = 0
+		self.num_record = 0
+
+	def wrap_state(self, fsmachine, stateid, statefunc):
+
+		def recorded():
+			myreturn = statefunc()
+			self.record(fsmachine.step_count, stateid, myreturn)
+			return myreturn
+
+		return recorded
+
+	def record(self, stepcount, stateid, myreturn):
+
+		pos = self.next_pos
+		self.step_array[pos] = stepcount
+		self.state_array[pos] = stateid
+		self.result_array[pos] = NO_RESULT if myreturn is None else (1 if myreturn else 0)
+
+		self.next_pos = pos + 1 if pos + 1 < self.size else 0
+		self.num_record += 1
+
+	def clear(self):
+		self.next_pos = 0
+		self.num_record = 0
+
+	def __len__(self):
+		return min(self.num_record, self.size)
+
+	def get_entries(self, maxentries=None):
+
+		# Most recent entries as (step, state ID, result) tuples, oldest first.
+		# Result is None for op states, True or False for queries
+		numentry = len(self) if maxentries is None else min(maxentries, len(self))
+		entries = []
+
+		for back in range(numentry, 0, -1):
+			pos = (self.next_pos - back) % self.size
+			rcode = self.result_array[pos]
+			entries.append((self.step_array[pos], self.state_array[pos], None if rcode == NO_RESULT else rcode == 1))
+
+		return entries
+
+	def find_last_visit(self, stateid):
+
+		# Most recent entry for the given state, or None if it has dropped out of the buffer
+		for back in range(1, len(self)+1):
+			pos = (self.next_pos - back) % self.size
+			if self.state_array[pos] == stateid:
+				rcode = self.result_array[pos]
+				return self.step_array[pos], stateid, None if rcode == NO_RESULT else rcode == 1
+
+		return None
+
+	def get_report_lines(self, fsmachine, maxentries=None):
+
+		yield "{:>12}  {:<6} {}".format("step", "result", "state")
+
+		for stepcount, stateid, result in self.get_entries(maxentries):
+			resultstr = "" if result is None else str(result)
+			yield "{:>12}  {:<6} {}".format(stepcount, resultstr, fsmachine.state_list[stateid].__name__)